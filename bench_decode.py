@@ -0,0 +1,291 @@
+#!/usr/bin/python3
+
+########################################################################################
+#     Domoticz Tuya Smart Plug Python Plugin                                              #
+#                                                                                      #
+#     MIT License                                                                        #
+#                                                                                      #
+#    Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#    Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#    of this software and associated documentation files (the "Software"), to deal      #
+#    in the Software without restriction, including without limitation the rights       #
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#    copies of the Software, and to permit persons to whom the Software is              #
+#    furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#    The above copyright notice and this permission notice shall be included in all     #
+#    copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#    SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+# Benchmark of the decode path of the plugin.
+#
+# Frames are replayed through plugin.onMessage with stubbed Domoticz and
+# Devices objects. The time of the decode stages (decrypt, json, device
+# update) is taken by the profiler of the plugin during a second replay;
+# framing is timed on its own with the reassembler of the plugin.
+#
+# usage: bench_decode.py [--frames N] [--repeat R] [--save FILE] [--compare FILE]
+#        bench_decode.py --corpus frames.hex --version 3.3 --dev-id ID --local-key KEY
+#        bench_decode.py --log frames_ID.log --local-key KEY
+#
+# A corpus file holds one hex encoded frame (as received from the device)
+# per line. Without --corpus, v3.1 plain text, v3.1 encrypted and v3.3
+# frames are synthesized. --log replays the data received in a log of the
+# plugin 'record' option instead. Run it before and after a change with
+# --save and --compare to catch regressions.
+
+import argparse
+import json
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+
+import frame_log
+import tuya_protocol
+
+DEV_ID = "benchthermostat0000"
+LOCAL_KEY = "0123456789abcdef"
+
+
+########################################################################################
+#
+# Domoticz stub
+#
+########################################################################################
+class StubDevice:
+
+    def __init__(self, Name, Unit, **kwargs):
+        self.Name = Name
+        self.Unit = Unit
+        self.nValue = 0
+        self.sValue = ""
+        self.TimedOut = 0
+
+    def Create(self):
+        sys.modules["plugin"].Devices[self.Unit] = self
+
+    def Update(self, nValue, sValue, TimedOut=0, **kwargs):
+        self.nValue = nValue
+        self.sValue = sValue
+        self.TimedOut = TimedOut
+
+
+class StubConnection:
+
+    instances = []
+
+    def __init__(self, Name, Transport, Address, Port, **kwargs):
+        self.Name = Name
+        self.Address = Address
+        self.Port = Port
+        StubConnection.instances.append(self)
+
+    def Connect(self):
+        pass
+
+    def Connected(self):
+        return True
+
+    def Connecting(self):
+        return False
+
+    def Send(self, Message, Delay=0):
+        pass
+
+    def Disconnect(self):
+        pass
+
+
+def _noop(*args, **kwargs):
+    pass
+
+
+def load_plugin(version, model):
+    domoticz = types.ModuleType("Domoticz")
+    for name in ("Debug", "Log", "Status", "Error", "Debugging", "Heartbeat"):
+        setattr(domoticz, name, _noop)
+    domoticz.Device = StubDevice
+    domoticz.Connection = StubConnection
+    sys.modules["Domoticz"] = domoticz
+
+    import plugin
+    plugin.Devices = {}
+    plugin.Parameters = {"Address": "127.0.0.1", "Mode1": DEV_ID, "Mode2": LOCAL_KEY,
+                         "Mode3": "2" if version == 3.3 else "1", "Mode4": "1.0",
+                         "Mode5": "model=" + model, "Mode6": "0",
+                         "HomeFolder": tempfile.mkdtemp(prefix="bench_decode_") + "/", "HardwareID": 1}
+    plugin._plugin = plugin.BasePlugin()
+    StubConnection.instances = []
+    plugin.onStart()
+    return plugin, StubConnection.instances[-1]
+
+
+########################################################################################
+#
+# corpus
+#
+########################################################################################
+def synthesize(kind, count):
+    crypto = tuya_protocol.CryptoContext(LOCAL_KEY)
+    rnd = random.Random(42)
+    frames = []
+    for i in range(count):
+        dps = {"1": rnd.random() < 0.9, "2": rnd.randint(30, 50), "3": rnd.randint(30, 50),
+               "4": rnd.choice(("0", "1")), "5": rnd.random() < 0.2, "6": False, "102": rnd.randint(30, 50)}
+        raw = json.dumps({"devId": DEV_ID, "dps": dps, "t": 1600000000 + i}, separators=(",", ":")).encode()
+        if kind == "3.1-plain":
+            payload = raw
+        elif kind == "3.1-encrypted":
+            payload = crypto.encrypt(raw)
+            payload = tuya_protocol.PROTOCOL_VERSION_BYTES_31 + crypto.sign31(payload) + payload
+        else:
+            payload = crypto.encrypt(raw, False)
+        frames.append(tuya_protocol.build_frame(tuya_protocol.CMD_DP_QUERY, payload, i, 0))
+    return frames
+
+
+def load_corpus(path):
+    with open(path) as f:
+        return [bytes.fromhex(line.strip()) for line in f if line.strip()]
+
+
+def load_log(path):
+    header = frame_log.read_header(frame_log.log_files(path)[0])
+    reads = [data for part in frame_log.log_files(path)
+             for _, direction, data in frame_log.read_log(part) if direction == frame_log.RECEIVED]
+    return reads, header
+
+
+########################################################################################
+#
+# measures
+#
+########################################################################################
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return time.perf_counter() - start
+
+
+def bench(name, frames, version, model, repeat):
+    plugin, connection = load_plugin(version, model)
+    count = len(frames) * repeat
+    result = {"frames": count}
+
+    def replay():
+        for frame in frames:
+            plugin.onMessage(connection, frame)
+
+    replay()  # warm up
+    elapsed = timed(replay, repeat)
+    result["frames_per_sec"] = count / elapsed
+    result["us_per_frame"] = elapsed / count * 1e6
+
+    # framing on its own, with the reassembler of the plugin
+    reassembler = tuya_protocol.FrameReassembler()
+
+    def framing():
+        for frame in frames:
+            reassembler.feed(frame)
+
+    result["framing_us"] = timed(framing, repeat) / count * 1e6
+
+    # decrypt, json and update as timed by the plugin itself in __update_status
+    class StageProfiler(plugin.Profiler):
+        # stage clocks only, cProfile would slow the stages down
+        def call(self, key, function, args):
+            return function(*args)
+
+    stages = StageProfiler("")
+    plugin._profiler = stages
+    timed(replay, repeat)
+    plugin._profiler = None
+    for stage in ("decrypt", "json", "update"):
+        result[stage + "_us"] = stages.wall(stage) / count * 1e6
+
+    # memory
+    tracemalloc.start()
+    blocks = sys.getallocatedblocks()
+    replay()
+    blocks = sys.getallocatedblocks() - blocks
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    result["peak_bytes_per_frame"] = peak / len(frames)
+    result["net_blocks_per_frame"] = blocks / len(frames)
+
+    return result
+
+
+def report(results, baseline):
+    columns = ("frames_per_sec", "us_per_frame", "framing_us", "decrypt_us", "json_us", "update_us",
+               "peak_bytes_per_frame", "net_blocks_per_frame")
+    print("%-14s" % "corpus" + "".join("%22s" % c for c in columns))
+    for name, result in results.items():
+        line = "%-14s" % name
+        for column in columns:
+            value = "%.2f" % result[column]
+            if baseline and name in baseline and baseline[name].get(column):
+                value += " (%+.0f%%)" % ((result[column] / baseline[name][column] - 1) * 100)
+            line += "%22s" % value
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the plugin decode path")
+    parser.add_argument("--frames", type=int, default=1000, help="frames per synthesized corpus")
+    parser.add_argument("--repeat", type=int, default=5, help="replays of each corpus")
+    parser.add_argument("--model", default="BHT-002")
+    parser.add_argument("--corpus", help="file of hex encoded frames to replay instead")
+    parser.add_argument("--log", help="frame log of the plugin to replay instead")
+    parser.add_argument("--version", type=float, default=3.3, help="protocol version of --corpus")
+    parser.add_argument("--dev-id", help="devID of the --corpus device")
+    parser.add_argument("--local-key", help="local key of the --corpus device")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file of a previous run to compare with")
+    args = parser.parse_args()
+
+    global DEV_ID, LOCAL_KEY
+    if args.corpus:
+        DEV_ID = args.dev_id or DEV_ID
+        LOCAL_KEY = args.local_key or LOCAL_KEY
+        corpora = {"corpus": (load_corpus(args.corpus), args.version)}
+    elif args.log:
+        reads, header = load_log(args.log)
+        DEV_ID = header["dev_id"]
+        LOCAL_KEY = args.local_key or LOCAL_KEY
+        corpora = {"log": (reads, float(header["version"]))}
+    else:
+        corpora = {kind: (synthesize(kind, args.frames), 3.3 if kind == "3.3" else 3.1)
+                   for kind in ("3.1-plain", "3.1-encrypted", "3.3")}
+
+    results = {}
+    for name, (frames, version) in corpora.items():
+        results[name] = bench(name, frames, version, args.model, args.repeat)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(results, baseline)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+########################################################################################
+#     Domoticz Tuya Smart Plug Python Plugin                                              #
+#                                                                                      #
+#     MIT License                                                                        #
+#                                                                                      #
+#    Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#    Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#    of this software and associated documentation files (the "Software"), to deal      #
+#    in the Software without restriction, including without limitation the rights       #
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#    copies of the Software, and to permit persons to whom the Software is              #
+#    furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#    The above copyright notice and this permission notice shall be included in all     #
+#    copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#    SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+# Binary log of the raw data exchanged with the thermostats.
+#
+# The file starts with MAGIC and a length prefixed JSON header (devID and
+# protocol version, never the local key), followed by records:
+#
+#   timestamp (double) | direction (byte) | length (uint32) | data
+#
+# Received data is logged as read from the socket, so the log keeps the
+# splits and coalesced frames seen by the reassembler. When a log grows
+# beyond max_bytes it is renamed to <path>.1 (<path>.1 to <path>.2 ...)
+# and a new one is started.
+#
+# read_log memory maps the file: only the data of the current record is
+# copied, whatever the size of the log.
+
+import json
+import mmap
+import os
+import struct
+import time
+
+MAGIC = b'TUYALOG1'
+RECEIVED = 0  # from the thermostat
+SENT = 1  # to the thermostat
+
+_HEADER_LENGTH = struct.Struct('>H')
+_RECORD = struct.Struct('>dBI')
+
+
+########################################################################################
+#
+# FrameRecorder
+#    append the data of one thermostat to a rotating log
+#
+########################################################################################
+class FrameRecorder:
+
+    def __init__(self, path, header, max_bytes=1024 * 1024, backups=3):
+        self.path = path
+        self.header = json.dumps(header, separators=(',', ':')).encode('utf-8')
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.__file = None
+        self.__size = 0
+
+    def __open(self):
+        self.__file = open(self.path, 'ab')
+        self.__size = self.__file.tell()
+        if self.__size == 0:
+            self.__file.write(MAGIC + _HEADER_LENGTH.pack(len(self.header)) + self.header)
+            self.__size = self.__file.tell()
+
+    def __rotate(self):
+        self.close()
+        for index in range(self.backups - 1, 0, -1):
+            source = self.path + '.' + str(index)
+            if os.path.exists(source):
+                os.replace(source, self.path + '.' + str(index + 1))
+        if self.backups > 0:
+            os.replace(self.path, self.path + '.1')
+        else:
+            os.remove(self.path)
+
+    def write(self, direction, data, timestamp=None):
+        if self.__file is None:
+            self.__open()
+        elif self.__size >= self.max_bytes:
+            self.__rotate()
+            self.__open()
+        record = _RECORD.pack(time.time() if timestamp is None else timestamp, direction, len(data))
+        self.__file.write(record)
+        self.__file.write(data)
+        self.__size += len(record) + len(data)
+
+    def flush(self):
+        if self.__file is not None:
+            self.__file.flush()
+
+    def close(self):
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+
+########################################################################################
+#
+# read_header
+#    the JSON header of a log
+#
+########################################################################################
+def read_header(path):
+    with open(path, 'rb') as file:
+        if file.read(len(MAGIC)) != MAGIC:
+            raise ValueError(path + ' is not a frame log')
+        length, = _HEADER_LENGTH.unpack(file.read(_HEADER_LENGTH.size))
+        return json.loads(file.read(length).decode('utf-8'))
+
+
+########################################################################################
+#
+# read_log
+#    yield (timestamp, direction, data) for each record of a log, a record
+#    cut by a crash at the end of the file is ignored
+#
+########################################################################################
+def read_log(path):
+    with open(path, 'rb') as file:
+        size = os.fstat(file.fileno()).st_size
+        if size <= len(MAGIC):
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as log:
+            if log[:len(MAGIC)] != MAGIC:
+                raise ValueError(path + ' is not a frame log')
+            length, = _HEADER_LENGTH.unpack_from(log, len(MAGIC))
+            pos = len(MAGIC) + _HEADER_LENGTH.size + length
+            while pos + _RECORD.size <= size:
+                timestamp, direction, length = _RECORD.unpack_from(log, pos)
+                pos += _RECORD.size
+                if pos + length > size:
+                    break
+                yield timestamp, direction, log[pos:pos + length]
+                pos += length
+
+
+########################################################################################
+#
+# log_files
+#    a log and its rotated parts, oldest first
+#
+########################################################################################
+def log_files(path):
+    files = []
+    index = 1
+    while os.path.exists(path + '.' + str(index)):
+        files.insert(0, path + '.' + str(index))
+        index += 1
+    if os.path.exists(path):
+        files.append(path)
+    return files
@@ -30,19 +30,78 @@
 import sys
 import pytuya
 import socket  # needed for socket.timeout exception
+import argparse
+import asyncio
+import json
 
+import inventory
+import tuya_client
+
+
+def bool_dps_list(dps):
+    # ';' separated keys of the boolean dps
+    return ";".join(str(int(key)) for key, value in dps.items() if type(value) is bool)
+
+
+########################################################################################
+#
+# fleet mode
+#    query every thermostat of an inventory at once, one json line per
+#    thermostat as soon as it answers or times out
+#
+########################################################################################
+def fleet(args):
+    parser = argparse.ArgumentParser(prog=sys.argv[0] + " --inventory",
+                                     description="status of every thermostat of an inventory")
+    parser.add_argument("--inventory", required=True, help="JSON or CSV inventory file")
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds given to each thermostat")
+    parser.add_argument("--concurrency", type=int, default=64, help="thermostats queried at the same time")
+    args = parser.parse_args(args)
+
+    try:
+        entries = inventory.load_inventory(args.inventory)
+    except (OSError, ValueError) as e:
+        print("Cannot read the inventory: " + str(e))
+        exit(1)
+
+    async def query(entry, link):
+        return await tuya_client.exchange(entry, "status", timeout=args.timeout, link=link)
+
+    async def scan():
+        failed = 0
+        async for entry, result, error, elapsed in tuya_client.run_all(entries, query, args.concurrency):
+            line = {"name": entry["name"], "address": entry["address"], "dev_id": entry["dev_id"],
+                    "version": entry["version"], "ok": error is None, "latency_ms": int(elapsed * 1000)}
+            if error is None:
+                dps = result.get("dps", {})
+                line["dps"] = dps
+                line["dps_list"] = bool_dps_list(dps)
+            else:
+                line["error"] = error
+                failed += 1
+            print(json.dumps(line), flush=True)
+        return failed
+
+    exit(1 if asyncio.run(scan()) else 0)
+
+
+if(len(sys.argv) > 1 and sys.argv[1].startswith("--")):
+    fleet(sys.argv[1:])
 
 if(len(sys.argv) != 5):
     print("usage: " + sys.argv[0] + " <IP> <DevID> <localkey> <version>")
+    print("       " + sys.argv[0] + " --inventory <file> [--timeout <seconds>] [--concurrency <n>]")
     exit(1)
 
-ip = sys.argv[1]
+ip, _, port = sys.argv[1].partition(':')  # <IP> may be <IP>:<port>
 devid = sys.argv[2]
 localKey = sys.argv[3]
 
 device = pytuya.OutletDevice(devid, ip, localKey)
+if port:
+    device.port = int(port)
 
-device.version = sys.argv[4]
+device.version = float(sys.argv[4])
 
 data = 0  # stub for the try except
 try:
@@ -56,14 +115,4 @@ print(data)
 
 print("\Device DPS List:")
 
-dps_list = ""
-first = True
-for key in data['dps'].keys():
-
-    if(type(data['dps'][key]) is bool):
-        if(not first):
-            dps_list += ";"
-        dps_list += str(int(key))
-        first = False
-
-print(dps_list)
+print(bool_dps_list(data['dps']))
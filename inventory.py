@@ -0,0 +1,120 @@
+########################################################################################
+#     Domoticz Tuya Smart Plug Python Plugin                                              #
+#                                                                                      #
+#     MIT License                                                                        #
+#                                                                                      #
+#    Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#    Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#    of this software and associated documentation files (the "Software"), to deal      #
+#    in the Software without restriction, including without limitation the rights       #
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#    copies of the Software, and to permit persons to whom the Software is              #
+#    furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#    The above copyright notice and this permission notice shall be included in all     #
+#    copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#    SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+# Thermostat inventory shared by the plugin and the command line tools.
+#
+# An inventory is either a JSON file holding a list of objects (or an
+# object with a "devices" list) or a CSV file with a header line. Each
+# entry needs an address, a devID and a local key; version defaults to 3.3
+# and name to the devID. Column / key aliases:
+#
+#   address:   address, ip
+#   dev_id:    dev_id, devid, id
+#   local_key: local_key, localkey, key
+#   version:   version (3.1 or 3.3)
+#   name:      name
+#   model:     model (see thermostat_models.MODELS)
+#   groups:    groups, group (list, or names separated by ';' in a CSV)
+#   cid:       cid, node_id (sub-device behind a gateway: address, dev_id
+#              and local_key are then the ones of the gateway)
+
+import csv
+import json
+
+ALIASES = {
+    'address': 'address', 'ip': 'address',
+    'dev_id': 'dev_id', 'devid': 'dev_id', 'id': 'dev_id',
+    'local_key': 'local_key', 'localkey': 'local_key', 'key': 'local_key',
+    'version': 'version',
+    'name': 'name',
+    'model': 'model',
+    'groups': 'groups', 'group': 'groups',
+    'cid': 'cid', 'node_id': 'cid',
+}
+
+REQUIRED = ('address', 'dev_id', 'local_key')
+
+VERSIONS = ('3.1', '3.3')
+
+
+########################################################################################
+#
+# normalize_entry
+#    map the aliases of a raw entry to the inventory keys
+#
+########################################################################################
+def normalize_entry(raw):
+    entry = {}
+    for key, value in raw.items():
+        name = ALIASES.get(str(key).strip().lower())
+        if name is not None and value is not None:
+            entry[name] = value if isinstance(value, list) else str(value).strip()
+
+    missing = [key for key in REQUIRED if not entry.get(key)]
+    if missing:
+        raise ValueError('Inventory entry ' + str(raw) + ' misses ' + ', '.join(missing))
+
+    entry.setdefault('version', '3.3')
+    if entry['version'] not in VERSIONS:
+        raise ValueError('Inventory entry ' + entry['dev_id'] + ' has an unsupported version: ' + entry['version'])
+    if not entry.get('cid'):
+        entry.pop('cid', None)
+    if not entry.get('name'):
+        entry['name'] = entry['dev_id'] + ('/' + entry['cid'] if 'cid' in entry else '')
+    groups = entry.get('groups', [])
+    if not isinstance(groups, list):
+        groups = groups.split(';')
+    entry['groups'] = [str(group).strip() for group in groups if str(group).strip()]
+    return entry
+
+
+########################################################################################
+#
+# load_inventory
+#    read a JSON or CSV inventory file, returns a list of entries
+#
+########################################################################################
+def load_inventory(path):
+    with open(path, newline='') as f:
+        if path.lower().endswith('.json'):
+            data = json.load(f)
+            if isinstance(data, dict):
+                data = data.get('devices', [])
+            rows = data
+        else:
+            rows = list(csv.DictReader(f))
+    return [normalize_entry(row) for row in rows]
+
+
+########################################################################################
+#
+# group_members
+#    entries of a named group
+#
+########################################################################################
+def group_members(entries, group):
+    return [entry for entry in entries if group in entry['groups']]
@@ -44,10 +44,12 @@
                 <option label="0.1 degree" value="0.2"/>
             </options>
         </param>
+        <param field="Mode5" label="Options" width="300px" default=""/>
         <param field="Mode6" label="Debug" width="75px">
             <options>
                 <option label="false"   value="0" default="true"/>
                 <option label="true"   value="1"/>
+                <option label="profile"   value="256"/>
             </options>
         </param>
     </params>
@@ -66,199 +68,586 @@
 # 32         Mask Value. Shows plugin framework debug messages related to Images objects.
 # 64         Mask Value. Dumps contents of inbound and outbound data from Connection objects.
 # 128         Mask Value. Shows plugin framework debug messages related to the message queue.
+# 256         Plugin value, not passed to Domoticz. Times the callbacks and writes profile.txt
+#             and profile.pstats to the plugin folder.
 
 import Domoticz
 import pytuya
 import json
-import math
+import os
+import random
+import time
+import cProfile
+import pstats
+from bisect import bisect_left
+import tuya_protocol
+import frame_log
+import tuya_discovery
+import inventory
+import thermostat_models
 
 ########################################################################################
 #
-# plugin object
+# request object
+#    a request waiting for its answer
 #
 ########################################################################################
 
 
-class BasePlugin:
+class Request:
+
+    __slots__ = ('seqno', 'cmd', 'frame', 'sent', 'deadline', 'retries', 'dps', 'owner')
+
+    def __init__(self, seqno, cmd, frame, sent, deadline, dps=None, owner=None):
+        self.seqno = seqno
+        self.cmd = cmd
+        self.frame = frame  # encoded frame, sent again on retry
+        self.sent = sent  # time of the first send, the latency includes the retries
+        self.deadline = deadline
+        self.retries = 0
+        self.dps = dps  # dps of a set command
+        self.owner = owner  # Thermostat that sent it, a sub-device of a gateway may share the connection
+
+
+########################################################################################
+#
+# write policy object
+#    decides which sensor readings are written to the Domoticz database
+#
+#    deadband:     changes smaller or equal to this are not written
+#    min_interval: seconds between two writes of a unit
+#    refresh:      seconds after which the reading is written even if it
+#                  did not change, 0 disables it
+#
+########################################################################################
+
+
+class WritePolicy:
+
+    SKIP = 0
+    WRITE = 1
+    REFRESH = 2  # write even if the value did not change
+    LIMITED = 3  # changed but the unit was written too recently, not written
+
+    def __init__(self, deadband, min_interval, refresh):
+        self.deadband = deadband
+        self.min_interval = min_interval
+        self.refresh = refresh
+        self.__last = {}  # unit -> (value, time) of the last write
+
+    # baseline of a unit restored from the snapshot, as if written at time
+    def seed(self, unit, value, time):
+        self.__last[unit] = (value, time)
+
+    def check(self, unit, value, now):
+        last = self.__last.get(unit)
+        result = self.WRITE
+        if last is not None:
+            elapsed = now - last[1]
+            if self.refresh > 0 and elapsed >= self.refresh:
+                result = self.REFRESH
+            elif abs(value - last[0]) <= self.deadband + 1e-9:
+                return self.SKIP
+            elif elapsed < self.min_interval:
+                return self.LIMITED
+        self.__last[unit] = (value, now)
+        return result
+
+
+########################################################################################
+#
+# network statistics object
+#    request to reply latency histogram and error counters
+#
+#    Recording only increments preallocated counters, so it stays enabled
+#    all the time. The counters cover the period since the last clear().
+#
+########################################################################################
+
+
+class NetworkStats:
+
+    BOUNDS = (25, 50, 100, 200, 500, 1000, 2000, 5000)  # upper bounds of the buckets (ms)
+    # payloads_cached: identical to the previous payload, not decoded again (fingerprint)
+    COUNTERS = ('timeouts', 'reconnects', 'decode_failures', 'error_replies', 'dropped_frames',
+                'payloads_cached', 'payloads_decoded')
+
+    def __init__(self):
+        self.buckets = [0] * (len(self.BOUNDS) + 1)  # the last one holds the slower replies
+        self.clear()
+
+    def clear(self):
+        for i in range(len(self.buckets)):
+            self.buckets[i] = 0
+        self.replies = 0
+        self.latency_total = 0.0  # ms
+        self.timeouts = 0
+        self.reconnects = 0
+        self.decode_failures = 0
+        self.error_replies = 0  # answers with a non zero return code
+        self.dropped_frames = 0
+        self.payloads_cached = 0
+        self.payloads_decoded = 0
+
+    def record(self, latency):
+        ms = latency * 1000
+        self.buckets[bisect_left(self.BOUNDS, ms)] += 1
+        self.replies += 1
+        self.latency_total += ms
+
+    def add(self, other):
+        for i, count in enumerate(other.buckets):
+            self.buckets[i] += count
+        self.replies += other.replies
+        self.latency_total += other.latency_total
+        for name in self.COUNTERS:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def percentile(self, fraction):
+        # upper bound of the bucket holding the percentile, None when slower than all bounds
+        if self.replies == 0:
+            return 0
+        rank = fraction * self.replies
+        seen = 0
+        for bound, count in zip(self.BOUNDS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return None
+
+    def average(self):
+        return self.latency_total / self.replies if self.replies else 0.0
+
+    def summary(self):
+        def bound(value):
+            return ">" + str(self.BOUNDS[-1]) if value is None else str(value)
+        return ("replies " + str(self.replies) +
+                ", avg " + str(int(self.average())) + " ms" +
+                ", p50 " + bound(self.percentile(0.5)) + " ms" +
+                ", p90 " + bound(self.percentile(0.9)) + " ms" +
+                ", timeouts " + str(self.timeouts) +
+                ", reconnects " + str(self.reconnects) +
+                ", decode failures " + str(self.decode_failures) +
+                ", error replies " + str(self.error_replies) +
+                ", dropped frames " + str(self.dropped_frames) +
+                ", payloads cached " + str(self.payloads_cached) + " decoded " + str(self.payloads_decoded))
+
+    def as_dict(self):
+        result = {"replies": self.replies,
+                  "average_ms": round(self.average(), 1),
+                  "histogram_ms": dict(zip([str(bound) for bound in self.BOUNDS] + ["more"], self.buckets))}
+        for name in self.COUNTERS:
+            result[name] = getattr(self, name)
+        return result
+
+
+########################################################################################
+#
+# profiler object
+#    wall and CPU time of the callbacks, of each thermostat and of the
+#    decode stages, plus a cProfile of the whole plugin
+#
+#    Domoticz runs the callbacks of every plugin on a single thread: the
+#    max column shows the thermostat that holds it the longest.
+#
+########################################################################################
+
+
+class Profiler:
+
+    DUMP_INTERVAL = 300  # seconds between two dumps
+
+    def __init__(self, folder):
+        self.folder = folder
+        self.__times = {}  # key -> [calls, wall, cpu, max wall]
+        self.__profile = cProfile.Profile()
+        self.__depth = 0  # only the outermost call enables cProfile
+        self.__dump_due = time.time() + self.DUMP_INTERVAL
+
+    def clock(self):
+        return time.perf_counter(), time.process_time()
+
+    def add(self, key, start):
+        wall, cpu = self.clock()
+        times = self.__times.get(key)
+        if times is None:
+            times = self.__times[key] = [0, 0.0, 0.0, 0.0]
+        times[0] += 1
+        times[1] += wall - start[0]
+        times[2] += cpu - start[1]
+        times[3] = max(times[3], wall - start[0])
+        return wall, cpu
+
+    # seconds spent in key so far
+    def wall(self, key):
+        times = self.__times.get(key)
+        return times[1] if times else 0.0
+
+    def call(self, key, function, args):
+        if self.__depth == 0:
+            self.__profile.enable()
+        self.__depth += 1
+        start = self.clock()
+        try:
+            return function(*args)
+        finally:
+            self.add(key, start)
+            self.__depth -= 1
+            if self.__depth == 0:
+                self.__profile.disable()
+                if time.time() >= self.__dump_due:
+                    self.dump()
+
+    def report(self):
+        lines = ["%-40s %8s %10s %10s %10s" % ("callback / stage", "calls", "wall ms", "cpu ms", "max ms")]
+        for key, (calls, wall, cpu, longest) in sorted(self.__times.items(), key=lambda item: -item[1][1]):
+            if isinstance(key, tuple):
+                key = " ".join(key)  # (callback, dev id) of a thermostat
+            lines.append("%-40s %8d %10.1f %10.1f %10.1f" % (key, calls, wall * 1000, cpu * 1000, longest * 1000))
+        return "\n".join(lines) + "\n"
+
+    def dump(self):
+        self.__dump_due = time.time() + self.DUMP_INTERVAL
+        try:
+            with open(os.path.join(self.folder, "profile.txt"), "w") as file:
+                file.write(self.report())
+            pstats.Stats(self.__profile).dump_stats(os.path.join(self.folder, "profile.pstats"))
+        except (OSError, TypeError) as e:  # TypeError: nothing profiled yet
+            Domoticz.Error("Cannot write the profile to " + self.folder + ": " + str(e))
+
+
+########################################################################################
+#
+# thermostat object
+#    one tuya device, its connection and its block of Domoticz units
+#
+########################################################################################
+
+
+class Thermostat:
 
     #######################################################################
     #
     # constant definition
     #
     #######################################################################
-    __HB_BASE_FREQ = 2  # heartbeat frequency (val x 10 seconds)
+    TICK = 10  # seconds between two calls of onHeartbeat
+    POLL_MIN = 10  # status poll interval after a command or a change (seconds)
+    POLL_MAX = 60  # status poll interval once readings are stable (seconds)
+    POLL_BACKOFF = 1.5  # interval growth after a poll without change
+    POLL_JITTER = 0.2  # random part of the poll interval, spreads the polls of the thermostats
+    BACKOFF_BASE = 5  # delay before reconnecting after the first failure (seconds)
+    BACKOFF_MAX = 300  # longest delay between two connection attempts (seconds)
+    OFFLINE_AFTER = 3  # failures in a row before the devices are marked as timed out
+    PUSH_SILENCE = 120  # push mode: poll after this many seconds without status (seconds)
+    DEBOUNCE = 1.0  # writes are merged during this window (seconds)
+    REQUEST_TIMEOUT = 5  # time to wait for an answer before sending a request again (seconds)
+    REQUEST_RETRIES = 2  # number of times a request is sent again before giving up
+    ECHO_TIMEOUT = 2  # time for the device to report the dps of a set before polling (seconds)
+    UNITS_PER_DEVICE = 8  # size of the block of Domoticz units of a thermostat
 
     #######################################################################
     #
     # __update_status
     #
     # Parameter
-    #    Data: a received payload from the tuya smart plug
+    #    payload: the payload of a frame received from the tuya device
+    #             (return code, crc and suffix already removed)
     #
-    # Returns a tuple (bool,dict)
-    #    first:  set to True if an error occur and False otherwise
-    #    second: dict of the dps (irrelevant if first is True )
+    # Returns (thermostat, dps): the thermostat the payload is for (a
+    # sub-device when it holds a cid) and the decoded dps, (None, None) if
+    # the payload holds none
     #
     #######################################################################
-    def __update_status(self, Data):
-
-        payload = Data[20:-8]
+    def __update_status(self, payload):
 
         if len(payload) == 0:
-            Domoticz.Debug('Empty payload (probably a response to set)')
-            return
-
-        Domoticz.Debug('Got payload: ' + str(payload))
-
-        # try:
-
-        if self.__version_id == 1:
-
-            if payload.startswith(b'{'):
-                # got plain text status response
-                jsonstr = payload
-
-                # sometimes thermostat send the same status payload twice (probably a bug)
-                end = jsonstr.find(b'}}')
-                if(end == -1):
-                    Domoticz.Error("Invalid payload received: " + str(Data))
-                    return
-
-                end = end+2
-                jsonstr = jsonstr[:end]
-
-            elif payload.startswith(pytuya.PROTOCOL_VERSION_BYTES_31):
-                # got an encrypted payload, happens occasionally
-                # expect resulting json to look similar to:: {"devId":"ID","dps":{"1":true,"2":0},"t":EPOCH_SECS,"s":3_DIGIT_NUM}
-                # NOTE dps.2 may or may not be present
-                # remove version header
-                payload = payload[len(pytuya.PROTOCOL_VERSION_BYTES_31):]
-                # remove (what I'm guessing, but not confirmed is) 16-bytes of MD5 hexdigest of payload
-                payload = payload[16:]
-                cipher = pytuya.AESCipher(self.__device.local_key)
-                # Payload is in base64
-                jsonstr = cipher.decrypt(payload)
-                Domoticz.Debug('Decrypted result: ' + str(jsonstr))
+            Debug('Empty payload (probably a response to set)')
+            return None, None
+
+        # an idle thermostat keeps sending the same payload: nothing to decode
+        # (the previous payload is kept as fingerprint, compared byte for byte)
+        now = time.time()
+        if payload == self.__last_payload and now < self.__last_payload_expiry:
+            self.stats.payloads_cached += 1
+            self.__last_payload_member.__last_status = now
+            return self.__last_payload_member, self.__last_payload_dps
+        self.stats.payloads_decoded += 1
+        fingerprint = bytes(payload)  # the version header is stripped from payload below
+
+        Debug('Got payload: %s', payload)
+
+        profiler = _profiler
+        if profiler:
+            stage = profiler.clock()
+
+        # a truncated or corrupted body fails in the cipher (ValueError) or
+        # in the base64 decoding (binascii.Error, a ValueError too)
+        try:
+            if self.__version_id == 1:
+
+                if payload[:1] == b'{':
+                    # got plain text status response
+                    jsonstr = bytes(payload)
+
+                elif payload[:len(pytuya.PROTOCOL_VERSION_BYTES_31)] == pytuya.PROTOCOL_VERSION_BYTES_31:
+                    # got an encrypted payload, happens occasionally
+                    # expect resulting json to look similar to:: {"devId":"ID","dps":{"1":true,"2":0},"t":EPOCH_SECS,"s":3_DIGIT_NUM}
+                    # NOTE dps.2 may or may not be present
+                    # remove version header
+                    payload = payload[len(pytuya.PROTOCOL_VERSION_BYTES_31):]
+                    # remove (what I'm guessing, but not confirmed is) 16-bytes of MD5 hexdigest of payload
+                    payload = payload[16:]
+                    # Payload is in base64
+                    jsonstr = self.__crypto.decrypt(bytes(payload))
+                    Debug('Decrypted result: %s', jsonstr)
+                else:
+                    Domoticz.Error(
+                        "Unknown payload, please try encrypted v3.3 protocol")
+                    self.stats.decode_failures += 1
+                    return None, None
+
+            elif self.__version_id == 2:
+
+                if payload[:len(pytuya.PROTOCOL_VERSION_BYTES_33)] == pytuya.PROTOCOL_VERSION_BYTES_33:
+                    # Status pushed by the device (and the answer to a set) carry
+                    # a version header: 33 2e 33 followed by 12 bytes
+                    payload = payload[len(tuya_protocol.PROTOCOL_33_HEADER):]
+
+                # Payload is in raw bytes, not base64
+                jsonstr = self.__crypto.decrypt(payload, False)
+                Debug('Decrypted result: %s', jsonstr)
             else:
-                Domoticz.Error(
-                    "Unknown payload, please try encrypted v3.3 protocol")
-                return
-
-        elif self.__version_id == 2:
-
-            if payload.startswith(pytuya.PROTOCOL_VERSION_BYTES_33):
-                # For 3.3 version protocol after setting dps there can be
-                # a message that cannot be decrypted
-                # Always starts with 33 2e 33 00 00 00 00 00 00
-                payload = payload[len(pytuya.PROTOCOL_VERSION_BYTES_33):]
-                # remove (what I'm guessing, but not confirmed is) 16-bytes of MD5 hexdigest of payload
-                payload = payload[16:]
-                # the approach from v3.1 does not work
-                # discard this payload for now
-                return
+                Domoticz.Error('Unexpected status() payload=' + str(bytes(payload)))
+                self.stats.decode_failures += 1
+                return None, None
+        except (ValueError, TypeError) as e:
+            Domoticz.Error("Payload decryption failed: " + str(e))
+            self.stats.decode_failures += 1
+            return None, None
 
-            cipher = pytuya.AESCipher(self.__device.local_key)
-            # Payload is in raw bytes, not base64
-            jsonstr = cipher.decrypt(payload, False)
-            Domoticz.Debug('Decrypted result: ' + str(jsonstr))
-        else:
-            Domoticz.Error('Unexpected status() payload=' + str(payload))
+        if profiler:
+            stage = profiler.add("decrypt", stage)
 
         try:
             if not isinstance(jsonstr, str):
                 jsonstr = jsonstr.decode()
             result = json.loads(jsonstr)
-            Domoticz.Debug("Loaded: " + str(result['dps']))
-        except (JSONError, KeyError) as e:
+            Debug("Loaded: %s", result['dps'])
+        except (ValueError, KeyError) as e:
             Domoticz.Error("Payload parse failed: " + str(jsonstr))
-            return
+            self.stats.decode_failures += 1
+            return None, None
+
+        # the answers for a sub-device may leave the devID out
+        if result.get('devId', self.__devID) != self.__devID:
+            Domoticz.Error("Invalid payload received for " + str(result['devId']))
+            self.stats.decode_failures += 1
+            return None, None
+
+        # a gateway: the sub-device is given by the cid
+        member = self
+        if self.__members:
+            member = self.__members.get(result.get('cid'))
+            if member is None:
+                Debug("Status of an unknown sub-device: %s", result.get('cid'))
+                return None, None
 
-        # start = Data.find(b'{"devId')
+        if ((type(result['dps']) is dict) == False):
+            Domoticz.Error("Invalid dps block: " + jsonstr)
+            self.stats.decode_failures += 1
+            return None, None
+
+        member.__last_status = now
 
-        # if(start == -1):
-        #     # Domoticz.Error("Invalid payload received: " + str(Data))
-        #     Domoticz.Debug("Got non dps response: " +
-        #                    str(Data) + ", probably set response")
-        #     return
+        if profiler:
+            stage = profiler.add("json", stage)
 
-        # jsonstr = Data[start:]
+        limited = member.__apply_dps(result['dps'], now)
 
-        # end = jsonstr.find(b'}}')
+        if profiler:
+            profiler.add("update", stage)
 
-        # if(end == -1):
-        #     Domoticz.Error("Invalid payload received: " + str(Data))
-        #     return
+        if limited:
+            # a reading held back by min_write must be decoded again to be written
+            self.__last_payload = None
+            return member, result['dps']
 
-        # end = end+2
-        # jsonstr = jsonstr[:end]
+        self.__last_payload = fingerprint
+        self.__last_payload_member = member
+        self.__last_payload_dps = result['dps']
+        # the payload must be decoded again when the write policy forces a refresh
+        refresh = member.__write_policy.refresh
+        self.__last_payload_expiry = now + refresh if refresh > 0 else float("inf")
+
+        return member, result['dps']
+
+    #######################################################################
+    #
+    # __apply_dps
+    #    update the Domoticz devices of the dps present in a status
+    #
+    # Returns True when the rate limit held back a changed reading
+    #
+    #######################################################################
+    def __apply_dps(self, dps_values, now):
+
+        limited = False
+        decoders = self.__decoders
+        for dps, value in dps_values.items():
+            decoder = decoders.get(dps)
+            if decoder is None:
+                continue
+            offset, decode, sensor = decoder
+            try:
+                values = decode(value)
+            except (TypeError, ValueError):
+                Domoticz.Error("Invalid value for dps " + dps + ": " + str(value))
+                continue
+            if values is None:
+                continue
+
+            unit = self.__base + offset
+            if sensor:
+                # deadband and rate limit of the temperature readings
+                write = self.__write_policy.check(unit, float(values[1]), now)
+                if write == WritePolicy.SKIP:
+                    continue
+                if write == WritePolicy.LIMITED:
+                    limited = True
+                    continue
+                UpdateDevice(unit, values[0], values[1], AlwaysUpdate=write == WritePolicy.REFRESH)
+            else:
+                UpdateDevice(unit, values[0], values[1])
+        return limited
 
-        # try:
-        #     result = json.loads(jsonstr)
-        #     Domoticz.Debug("Loaded: " + str(result['dps']))
-        # except (JSONError, KeyError) as e:
-        #     Domoticz.Error("Payload parse failed: " + jsonstr)
-        #     return
+    #######################################################################
+    #
+    # __keep_alive
+    #    push mode: ping the tuya device to keep the connection open and
+    #    fall back to a status request when it has been silent too long
+    #
+    #######################################################################
+    def __keep_alive(self):
 
-        if result['devId'] != self.__devID:
-            Domoticz.Error("Invalid payload received for " + result['devId'])
+        if(not self.__connection.Connected()):
+            self.__request_status()
             return
 
-        if ((type(result['dps']) is dict) == False):
-            Domoticz.Error("Invalid dps block: " + jsonstr)
+        if(time.time() - self.__last_status >= self.__push_silence):
+            Debug("No status pushed for %ss, polling", self.__push_silence)
+            self.__request_status()
             return
 
-        try:
-            if result['dps']['1']:
-                UpdateDevice(self.__control_device, 1, "On")
-            else:
-                UpdateDevice(self.__control_device, 0, "Off")
-        except KeyError:
-            pass
+        if(self.__link is self):
+            self.__send_request('heartbeat')
 
-        try:
-            current_temp = str(round(result['dps']['2']/2 * self.__multiplier, 1))
-            # TODO check which value shoud be set
-            UpdateDevice(self.__thermostat_device, 0, current_temp)
-        except KeyError:
-            pass
+    #######################################################################
+    #
+    # __send_request
+    #    send a command and record it until its answer arrives
+    #
+    #######################################################################
+    def __send_request(self, command, dps=None, delay=0, owner=None):
+
+        # the sub-devices of a gateway send through the thermostat holding the connection
+        if(self.__link is not self):
+            return self.__link.__send_request(command, dps, delay, self)
+        owner = owner or self
+
+        self.__seqno = (self.__seqno + 1) & 0xffffffff
+        payload = None
+        if(dps is None):
+            payload = owner.__payloads.frame(command, self.__seqno)
+        if(payload is None):
+            payload = tuya_protocol.generate_payload(
+                owner.__crypto, self.__devID, owner.__device.version, command, dps, self.__seqno, owner.__cid)
+        sent = time.time() + delay
+        request = Request(self.__seqno, tuya_protocol.COMMANDS[command], payload,
+                          sent, sent + self.REQUEST_TIMEOUT, dps, owner)
+        if(self.__recorder):
+            self.__recorder.write(frame_log.SENT, payload, sent)
+        self.__requests[(request.seqno, request.cmd)] = request
+        if(delay > 0):
+            self.__connection.Send(payload, Delay=delay)
+        else:
+            self.__connection.Send(payload)
+        return payload
 
-        try:
-            if result['dps']['4'] == "1":
-                UpdateDevice(self.__mode_device, 10, "10")
-            else:
-                UpdateDevice(self.__mode_device, 20, "20")
-        except KeyError:
-            pass
+    #######################################################################
+    #
+    # __match_request
+    #    remove and return the request answered by a frame, None when the
+    #    frame was sent by the device on its own
+    #
+    #######################################################################
+    def __match_request(self, frame):
 
-        try:
-            if result['dps']['6']:
-                UpdateDevice(self.__lock_device, 20, "20")
-            else:
-                UpdateDevice(self.__lock_device, 10, "10")
-        except KeyError:
-            pass
+        request = self.__requests.pop((frame.seqno, frame.cmd), None)
+        if request is None:
+            # some firmwares do not echo the sequence number: oldest request of the same type
+            for key, pending in self.__requests.items():
+                if pending.cmd == frame.cmd:
+                    request = self.__requests.pop(key)
+                    break
+        return request
 
-        try:
-            if result['dps']['5']:
-                UpdateDevice(self.__eco_device, 20, "20")
-            else:
-                UpdateDevice(self.__eco_device, 10, "10")
-        except KeyError:
-            pass
+    #######################################################################
+    #
+    # check_requests
+    #    send again the requests not answered in time, give up on the
+    #    connection when a request ran out of retries
+    #
+    #######################################################################
+    def check_requests(self, now):
+
+        self.__check_echo(None, now)
+
+        for key, request in list(self.__requests.items()):
+            if request.deadline > now:
+                continue
+
+            self.stats.timeouts += 1
+
+            if request.retries < self.REQUEST_RETRIES and self.__connection.Connected():
+                Debug("No answer to request %d, sending it again", request.seqno)
+                request.retries += 1
+                request.deadline = now + self.REQUEST_TIMEOUT
+                self.__connection.Send(request.frame)
+                if(self.__recorder):
+                    self.__recorder.write(frame_log.SENT, request.frame, now)
+                continue
+
+            Debug("No answer to request %d, giving up", request.seqno)
+            del self.__requests[key]
+            if(self.__connection.Connected()):
+                # the connection is probably dead, the next request reconnects
+                self.__connection.Disconnect()
+                self.__drop_requests()
+                self.__connection_failed()
+            break
 
-        # builtin sensor reading
-        try:
-            current_temp = str(round(result['dps']['3']/2 * self.__multiplier, 1))
-            UpdateDevice(self.__temp_device, 0, current_temp)
-        except KeyError:
-            pass
+    #######################################################################
+    #
+    # __drop_requests
+    #    forget the requests of a closed connection, the changes of the
+    #    unanswered set commands go back to the write buffer
+    #
+    #######################################################################
+    def __drop_requests(self):
 
-        # External sensor present
-        try:
-            current_temp = str(round(result['dps']['102']/2 * self.__multiplier, 1))
-            UpdateDevice(self.__external_temp_device, 0, current_temp)
-        except KeyError:
-            pass
+        for member in self.__group():
+            member.__echo_dps = None
+
+        for request in self.__requests.values():
+            if request.dps:
+                owner = request.owner
+                if(not owner.__pending_dps):
+                    owner.__pending_since = time.time()
+                dps = dict(request.dps)
+                dps.update(owner.__pending_dps)
+                owner.__pending_dps = dps
+        self.__requests = {}
 
     #######################################################################
     #
@@ -268,175 +657,522 @@ class BasePlugin:
     #
     #######################################################################
 
-    def __request_status(self):
+    def __request_status(self, delay=0):
 
-        self.__runAgain = self.__HB_BASE_FREQ
+        self.__schedule_poll(time.time() + delay)
 
         if(self.__connection.Connected()):
-            self.__state_machine = 2
-            payload = self.__device.generate_payload('status')
-            self.__connection.Send(payload)
+            # one status request in flight is enough
+            for request in self.__link.__requests.values():
+                if request.cmd == tuya_protocol.CMD_DP_QUERY and request.owner is self:
+                    return
+            self.__send_request('status', delay=delay)
 
         else:
-            if(not self.__connection.Connecting()):
-                self.__connection.Connect()
+            self.__status_wanted = True
+            self.__connect()
+
+    #######################################################################
+    #
+    # __connect
+    #    open the connection unless waiting for the end of the backoff
+    #
+    #######################################################################
+    def __connect(self):
+        if(self.__link is not self):
+            self.__link.__connect()
+            return
+        if(self.__connection.Connecting() or time.time() < self.__retry_at or not self.__address):
+            return
+        self.__connection.Connect()
+
+    #######################################################################
+    #
+    # relocate
+    #    the device was discovered at another address or with another
+    #    protocol version: move to it right away instead of waiting for
+    #    the connection to the old address to time out
+    #
+    #    Returns the new connection, None when nothing changed
+    #
+    #######################################################################
+    def relocate(self, address, version):
+        version_id = {"3.1": 1, "3.3": 2}.get(version, self.__version_id)
+        if(address == self.__address and version_id == self.__version_id):
+            return None
+
+        Domoticz.Log(self.__devID + " found at " + address + " (v" + version +
+                     "), was " + (self.__address or "unknown"))
+
+        if(self.__connection.Connected() or self.__connection.Connecting()):
+            self.__connection.Disconnect()
+        self.__drop_requests()
+        self.__reassembler.reset()
+
+        self.__address = address
+        self.__version_id = version_id
+        self.__device.address = address
+        self.__device.version = 3.3 if version_id == 2 else 3.1
+        self.__payloads = tuya_protocol.payload_cache_for(
+            self.__payloads, self.__crypto, self.__devID, self.__device.version, self.__cid)
+
+        # no backoff for a new address, the devices stay timed out until it answers
+        self.__retry_at = 0
+        self.__open_connection()
+        for member in self.__group():
+            if(member is not self):
+                member.__follow(self)
+        for member in self.__group():
+            member.__request_status()
+        return self.__connection
+
+    def __open_connection(self):
+        self.__connection = Domoticz.Connection(
+            Name="Tuya v"+str(self.__device.version)+" "+self.__devID, Transport="TCP/IP", Address=self.__address, Port=self.__port)
+
+    #######################################################################
+    #
+    # __connection_failed
+    #    wait exponentially longer between attempts, mark the devices as
+    #    timed out after OFFLINE_AFTER failures in a row
+    #
+    #######################################################################
+    def __connection_failed(self):
+        self.__failures += 1
+        delay = min(self.BACKOFF_BASE * 2 ** (self.__failures - 1), self.__backoff_max)
+        self.__retry_at = time.time() + delay * random.uniform(0.5, 1.0)
+
+        if(self.__failures >= self.OFFLINE_AFTER and not self.__offline):
+            self.__offline = True
+            Domoticz.Log(self.__name + self.__address + " is offline, retrying every " +
+                         str(int(self.__backoff_max)) + "s at most")
+            self.__set_timed_out(1)
+
+    #######################################################################
+    #
+    # __device_answered
+    #    back to normal as soon as the device answers again
+    #
+    #######################################################################
+    def __device_answered(self):
+        self.__failures = 0
+        self.__retry_at = 0
+        if(self.__offline):
+            self.__offline = False
+            Domoticz.Log(self.__name + self.__address + " is back online")
+            self.__set_timed_out(0)
+
+    def __set_timed_out(self, timed_out):
+        for member in self.__group():
+            for unit in member.units():
+                if unit in Devices:
+                    UpdateDevice(unit, Devices[unit].nValue, Devices[unit].sValue, TimedOut=timed_out)
+
+    #######################################################################
+    #
+    # __schedule_poll
+    #    plan the next status poll from the current interval
+    #
+    #######################################################################
+    def __schedule_poll(self, now):
+        jitter = random.uniform(1 - self.POLL_JITTER, 1 + self.POLL_JITTER)
+        self.__next_poll = now + self.__poll_interval * jitter
+
+    #######################################################################
+    #
+    # __poll_if_due
+    #    send the status request of a poll due before the next heartbeat,
+    #    delayed by Domoticz to the planned time
+    #
+    #######################################################################
+    def __poll_if_due(self, now):
+        delay = self.__next_poll - now
+        if(delay < self.TICK):
+            self.__request_status(max(0, int(delay)))
+
+    #######################################################################
+    #
+    # __adapt_poll
+    #    poll faster after a change, back off while readings are stable
+    #
+    #######################################################################
+    def __adapt_poll(self, dps, polled, now):
+        changed = False
+        for key, value in dps.items():
+            if self.__last_dps.get(key) != value:
+                self.__last_dps[key] = value
+                changed = True
+
+        if(changed):
+            self.__poll_interval = self.__poll_min
+            self.__next_poll = min(self.__next_poll, now + self.__poll_min)
+        elif(polled):
+            self.__poll_interval = min(self.__poll_interval * self.POLL_BACKOFF, self.__poll_max)
+            self.__schedule_poll(now)
+
+    #######################################################################
+    #
+    # __queue_update
+    #    buffer a dps change, the last value written to a dps wins
+    #
+    #######################################################################
+    def __queue_update(self, dps, value):
+
+        if(not self.__pending_dps):
+            self.__pending_since = time.time()
+        self.__pending_dps[str(dps)] = value
+
+        if(self.__debounce <= 0):
+            self.flush_updates(force=True)
+
+    #######################################################################
+    #
+    # flush_updates
+    #    send the buffered dps changes as a single set command once the
+    #    debounce window is over, then ask the status once
+    #
+    #######################################################################
+    def flush_updates(self, now=None, force=False):
+
+        if(not self.__pending_dps):
+            return
+
+        if(not force and (now or time.time()) - self.__pending_since < self.__debounce):
+            return
+
+        if(not self.__connection.Connected()):
+            # keep the changes, they are sent as soon as the connection is up
+            self.__connect()
+            return
+
+        dict_payload = self.__pending_dps
+        self.__pending_dps = {}
+        self.__send_update(dict_payload)
+
+    # move the statistics of the period into total and start a new period
+    def collect_stats(self, total):
+        if self.__reassembler is not None:
+            self.stats.dropped_frames += self.__reassembler.dropped - self.__dropped_reported
+            self.__dropped_reported = self.__reassembler.dropped
+        total.add(self.stats)
+        self.stats.clear()
+
+    # devID, followed by /cid for a sub-device of a gateway
+    def dev_id(self):
+        return self.__devID + "/" + self.__cid if self.__cid else self.__devID
+
+    #######################################################################
+    #
+    # attach
+    #    make a sub-device of a gateway use the connection of the
+    #    thermostat holding it (owner), called before start
+    #
+    #######################################################################
+    def attach(self, owner):
+        self.__link = owner
+        owner.__members[self.__cid] = self
+        # the gateway holds the key and the protocol version
+        self.__localKey = owner.__localKey
+        self.__version_id = owner.__version_id
+
+    # thermostats sharing the connection of this one
+    def __group(self):
+        return self.__members.values() if self.__members else (self,)
+
+    # take the connection, address and protocol version of the owner
+    def __follow(self, owner):
+        self.__connection = owner.__connection
+        self.__address = owner.__address
+        self.__version_id = owner.__version_id
+        self.__device.address = owner.__address
+        self.__device.version = owner.__device.version
+        self.__payloads = tuya_protocol.payload_cache_for(
+            self.__payloads, self.__crypto, self.__devID, self.__device.version, self.__cid)
+
+    # True while buffered changes wait for the end of the debounce window
+    # or for the device to report them
+    def has_pending_updates(self):
+        return (len(self.__pending_dps) > 0 or self.__echo_dps is not None) and self.__connection.Connected()
+
+    #######################################################################
+    #
+    # __check_echo
+    #    the device reports the dps of a set in its answer or in a status
+    #    frame right after it; only poll when it does not
+    #
+    #######################################################################
+    def __check_echo(self, dps, now):
+
+        if(self.__echo_dps is None):
+            return
+
+        if(dps):
+            self.__echo_dps.difference_update(dps)
+            if(not self.__echo_dps):
+                self.__echo_dps = None
+                return
+
+        if(now >= self.__echo_deadline):
+            Debug("Set not echoed, requesting status")
+            self.__echo_dps = None
+            self.__request_status()
 
     #######################################################################
     #
     # __send_update
     #    send a command to the tuya device
     #
+    # Parameter
+    #    dict_payload: {dps: value} of all the dps to set
     #
     #######################################################################
-    def __send_update(self, dps, value):
+    def __send_update(self, dict_payload):
 
         if(self.__connection.Connected()):
-            self.__state_machine = 1
-            dict_payload = {str(dps): value}
+            Debug("__send_update dict: %s", dict_payload)
+            payload = self.__send_request('set', dict_payload)
+            Debug("__send_update payload: %s", payload)
 
-            Domoticz.Debug("__send_update dict: " + str(dict_payload))
-            payload = self.__device.generate_payload('set', dict_payload)
-            Domoticz.Debug("__send_update payload: " + str(payload))
-            self.__connection.Send(payload)
+            # wait for the new values instead of asking the status right away
+            if(self.__echo_dps is None):
+                self.__echo_dps = set()
+            self.__echo_dps.update(dict_payload.keys())
+            self.__echo_deadline = time.time() + self.ECHO_TIMEOUT
 
     #######################################################################
     #
     # constructor
     #
+    # Parameter
+    #    index: block of units of the thermostat
+    #    entry: inventory entry (name, address, dev_id, local_key, version)
+    #
     #######################################################################
-    def __init__(self):
-        self.__address = None  # IP address of the Thermostat
-        self.__devID = None  # devID of the Thermostat
-        self.__localKey = None  # localKey of the Thermostat
+    def __init__(self, index, entry):
+        self.index = index
+        self.__name = entry["name"] + " " if entry["name"] else ""  # name prefix of the Domoticz devices
+        # IP address of the Thermostat, optionally followed by :port
+        self.__address, _, self.__port = entry["address"].partition(":")
+        if self.__address == "auto":
+            self.__address = ""  # waits for a discovery broadcast of the device
+        self.__port = self.__port or "6668"
+        self.__devID = entry["dev_id"]  # devID of the Thermostat
+        self.__cid = entry.get("cid")  # node id of a sub-device behind a gateway
+        self.__link = self  # thermostat holding the connection, the gateway for a sub-device
+        self.__members = {self.__cid: self} if self.__cid else {}  # gateway: cid -> thermostat, itself included
+        self.__localKey = entry["local_key"]  # localKey of the Thermostat
         self.__device = None  # pytuya object of the Thermostat
-        self.__runAgain = self.__HB_BASE_FREQ  # heartbeat frequency
+        self.__crypto = None  # AES context shared by the receive and send paths
+        self.__payloads = None  # status and heartbeat frames, built with __crypto
+        # adaptive polling
+        self.__poll_min = self.POLL_MIN
+        self.__poll_max = self.POLL_MAX
+        self.__poll_interval = self.POLL_MIN
+        self.__next_poll = 0  # time of the next status poll
+        self.__status_wanted = False  # a status request waits for the connection
+        self.__last_dps = {}  # last value of each dps, to detect changes
+        # connection health
+        self.__failures = 0  # failed attempts in a row
+        self.__retry_at = 0  # no connection attempt before this time
+        self.__offline = False  # devices marked as timed out
+        self.__backoff_max = self.BACKOFF_MAX
         self.__connection = None  # connection to the tuya plug
+        self.__reassembler = None  # frame reassembler of the connection
         self.__multiplier = 1.0 #data multiplier for Thermostat resolution
-        # domotics control ID (On/Off switch)
-        self.__control_device = 1
-        self.__thermostat_device = 2
-        self.__mode_device = 3
-        self.__lock_device = 4
-        self.__eco_device = 5
-        self.__temp_device = 6
-        self.__external_temp_device = 7
-        # state_machine: 0 -> no waiting msg ; 1 -> set command sent ; 2 -> status command sent
-        self.__state_machine = 0
-        self.__version_id = 0
+        # domotics unit of offset 1 is base + 1
+        self.__base = index * self.UNITS_PER_DEVICE
+        self.__model = entry.get("model")  # None: the model option, BHT-002 by default
+        self.__decoders = {}  # dps -> (unit offset, decode, sensor)
+        self.__write_policy = None  # deadband / rate limit of the sensor units
+        # fingerprint of the last decoded payload
+        self.__last_payload = None
+        self.__last_payload_member = None
+        self.__last_payload_dps = None
+        self.__last_payload_expiry = 0
+        self.stats = NetworkStats()  # latency and errors since the last publication
+        self.__connected_once = False  # later connections are reconnects
+        self.__dropped_reported = 0  # frames dropped by the reassembler already in stats
+        self.__recorder = None  # frame_log.FrameRecorder of the record option
+        self.__encoders = {}  # unit offset -> (dps, encode)
+        # requests waiting for their answer, keyed by (seqno, cmd)
+        self.__requests = {}
+        self.__seqno = 0
+        self.__version_id = 2 if float(entry["version"]) == 3.3 else 1
+        # push mode: the connection is kept open and status frames pushed by the device are used
+        self.__push_mode = False
+        self.__push_silence = self.PUSH_SILENCE
+        self.__last_status = 0  # time of the last decoded status
+        # write buffer: dps changes waiting for the end of the debounce window
+        self.__debounce = self.DEBOUNCE
+        self.__pending_dps = {}
+        self.__pending_since = 0
+        # dps of the last set not reported by the device yet
+        self.__echo_dps = None
+        self.__echo_deadline = 0
         return
 
     #######################################################################
     #
-    # onStart Domoticz function
+    # units
+    #    Domoticz units owned by this thermostat
     #
     #######################################################################
-    def onStart(self):
+    def units(self):
+        base = self.index * self.UNITS_PER_DEVICE
+        return range(base + 1, base + self.UNITS_PER_DEVICE + 1)
 
-        # Debug mode
-        Domoticz.Debugging(int(Parameters["Mode6"]))
-        Domoticz.Debug("onStart called")
+    #######################################################################
+    #
+    # snapshot
+    #    state worth keeping across a restart of the plugin
+    #
+    #######################################################################
+    def snapshot(self):
+        return {"version": str(self.__device.version) if self.__device else None,
+                "dps": self.__last_dps,
+                "last_seen": int(self.__last_status),
+                "poll_interval": self.__poll_interval,
+                "failures": self.__failures}
 
-        # get parameters
-        self.__address = Parameters["Address"]
-        self.__devID = Parameters["Mode1"]
-        self.__localKey = Parameters["Mode2"]
-        self.__version_id = int(Parameters["Mode3"])
-        self.__multiplier = float(Parameters["Mode4"])
-
-        # set the next heartbeat
-        self.__runAgain = self.__HB_BASE_FREQ
-
-        # build internal maps (__control_device and __domoticz_controls)
-
-        self.__domoticz_controls = {}
-
-        # create domoticz devices
-        if(len(Devices) == 0):
-
-            Domoticz.Device(Name="Control",
-                            Unit=self.__control_device,
-                            Image=15,
-                            TypeName="Switch",
-                            Used=1).Create()
-
-            Domoticz.Log("Tuya Thermostat Control created.")
-
-            Domoticz.Device(Name="Setpoint",
-                            Unit=self.__thermostat_device,
-                            Image=15,
-                            Type=242,
-                            Subtype=1,
-                            Used=1).Create()
-
-            Domoticz.Log("Thermostat Setpoint created.")
-
-            ModeOptions = {"LevelActions": "|||",
-                           "LevelNames": "Off|Manual|Schedule",
-                           "LevelOffHidden": "true",
-                           "SelectorStyle": "0"}
-
-            Domoticz.Device(Name="Operating Mode",
-                            Unit=self.__mode_device,
-                            Image=15,
-                            TypeName="Selector Switch",
-                            Switchtype=18,
-                            Options=ModeOptions).Create()
-
-            LockOptions = {"LevelActions": "|||",
-                           "LevelNames": "Off|Unlocked|Locked",
-                           "LevelOffHidden": "true",
-                           "SelectorStyle": "0"}
-
-            Domoticz.Device(Name="Key Lock",
-                            Unit=self.__lock_device,
-                            Image=15,
-                            TypeName="Selector Switch",
-                            Switchtype=18,
-                            Options=LockOptions).Create()
-
-            EcoOptions = {"LevelActions": "|||",
-                          "LevelNames": "Off|Normal|Eco",
-                          "LevelOffHidden": "true",
-                          "SelectorStyle": "0"}
-
-            Domoticz.Device(Name="Eco Mode",
-                            Unit=self.__eco_device,
-                            Image=15,
-                            TypeName="Selector Switch",
-                            Switchtype=18,
-                            Options=EcoOptions).Create()
-
-            Domoticz.Device(Name="Temperature",
-                            Unit=self.__temp_device,
-                            Image=15,
-                            TypeName="Temperature",
-                            Used=1).Create()
-
-            Domoticz.Device(Name="Floor Temperature",
-                            Unit=self.__external_temp_device,
-                            Image=15,
-                            TypeName="Temperature",
-                            Used=0).Create()
+    #######################################################################
+    #
+    # __restore
+    #    start from a snapshot instead of an empty state: the first status
+    #    is compared to the saved dps, the temperature baselines and the
+    #    poll interval are the ones of the previous run
+    #
+    #######################################################################
+    def __restore(self, saved):
+        version = 3.3 if self.__version_id == 2 else 3.1
+        try:
+            if float(saved["version"]) != version:
+                return  # saved with another protocol version, probably another device
+            dps = dict(saved["dps"])
+            last_seen = float(saved["last_seen"])
+            poll_interval = float(saved["poll_interval"])
+            failures = int(saved["failures"])
+        except (KeyError, TypeError, ValueError):
+            return
+
+        self.__last_dps = dps
+        self.__last_status = last_seen
+
+        # the deadband goes on from the reading shown by Domoticz, the last
+        # dps may hold a reading the deadband kept from being written
+        for key in dps:
+            decoder = self.__decoders.get(key)
+            if decoder is None or not decoder[2]:
+                continue
+            unit = self.__base + decoder[0]
+            if unit not in Devices:
+                continue
+            try:
+                self.__write_policy.seed(unit, float(Devices[unit].sValue), last_seen)
+            except ValueError:
+                continue
+
+        # the poll backoff goes on where it stopped
+        now = time.time()
+        self.__poll_interval = min(max(poll_interval, self.__poll_min), self.__poll_max)
+        self.__next_poll = max(now, min(last_seen + self.__poll_interval, now + self.__poll_interval))
+        self.__next_poll += random.uniform(0, self.__poll_min)
+
+        # an unreachable device keeps its connection backoff (its devices
+        # are still timed out in Domoticz)
+        self.__failures = max(failures, 0)
+        self.__offline = self.__failures >= self.OFFLINE_AFTER
+
+    #######################################################################
+    #
+    # start
+    #    called from onStart: create the devices and open the connection
+    #
+    #    Returns the connection, None for a sub-device of a gateway
+    #
+    #######################################################################
+    def start(self, multiplier, options, saved=None):
+
+        self.__multiplier = multiplier
+        self.__push_mode = options.get("push", "0") == "1"
+        self.__push_silence = int(options.get("silence", self.PUSH_SILENCE))
+        self.__debounce = float(options.get("debounce", self.DEBOUNCE))
+        self.__poll_min = float(options.get("poll_min", self.POLL_MIN))
+        self.__poll_max = max(self.__poll_min, float(options.get("poll_max", self.POLL_MAX)))
+        self.__backoff_max = float(options.get("backoff_max", self.BACKOFF_MAX))
+
+        # spread the first poll of the thermostats
+        self.__poll_interval = self.__poll_min
+        self.__next_poll = time.time() + random.uniform(0, self.__poll_min)
+
+        # dps <-> Domoticz tables of the model
+        self.__model = self.__model or options.get("model", thermostat_models.DEFAULT_MODEL)
+        self.__decoders, self.__encoders = thermostat_models.compile_model(
+            self.__model, self.__multiplier)
+        self.__write_policy = WritePolicy(float(options.get("deadband", 0)),
+                                          float(options.get("min_write", 0)),
+                                          float(options.get("refresh", 0)))
+
+        # warm start from the state saved by the previous run
+        if saved:
+            self.__restore(saved)
+
+        # create domoticz devices (unless the user deleted all of them)
+        if not any(unit in Devices for unit in self.units()):
+
+            for spec in thermostat_models.MODELS[self.__model]:
+                Domoticz.Device(Name=self.__name + spec["name"],
+                                Unit=self.__base + spec["unit"],
+                                Image=15,
+                                **spec["device"]).Create()
+
+                Domoticz.Log(self.__name + spec["name"] + " created.")
 
         # create the pytuya object
         self.__device = pytuya.OutletDevice(
             self.__devID, self.__address, self.__localKey)
+        self.__device.port = int(self.__port)
 
         if self.__version_id == 1:
             self.__device.version = 3.1
-            Domoticz.Debug("Initialized v3.1 connection")
+            Debug("Initialized v3.1 connection")
 
         if self.__version_id == 2:
             self.__device.version = 3.3
-            Domoticz.Debug("Initialized v3.3 connection")
-
-        # state machine
-        self.__state_machine = 0
-
-        # start the connection
-        self.__connection = Domoticz.Connection(
-            Name="Tuya v"+str(self.__device.version), Transport="TCP/IP", Address=self.__address, Port="6668")
-        self.__connection.Connect()
+            Debug("Initialized v3.3 connection")
+
+        # build the AES context once, it only changes with the local key
+        self.__crypto = tuya_protocol.crypto_for_key(
+            self.__crypto, self.__localKey)
+
+        # status and heartbeat frames only change with the key or the version
+        self.__payloads = tuya_protocol.payload_cache_for(
+            self.__payloads, self.__crypto, self.__devID, self.__device.version, self.__cid)
+
+        # a sub-device talks through the connection of its gateway
+        if(self.__link is not self):
+            self.__follow(self.__link)
+            return None
+
+        # outstanding requests
+        self.__requests = {}
+
+        # frames may be split or coalesced by TCP, reassemble them
+        self.__reassembler = tuya_protocol.FrameReassembler()
+
+        # raw traffic log, replayed by replay_frames.py
+        if options.get("record") and not os.path.isdir(options["record"]):
+            Domoticz.Error("Cannot record the frames, " + options["record"] + " is not a folder")
+        elif options.get("record"):
+            self.__recorder = frame_log.FrameRecorder(
+                os.path.join(options["record"], "frames_" + self.__devID + ".log"),
+                {"dev_id": self.__devID, "version": str(self.__device.version), "model": self.__model},
+                int(options.get("record_max", 1024 * 1024)))
+
+        # start the connection (an unknown address waits for the discovery)
+        self.__open_connection()
+        if(self.__address):
+            self.__connection.Connect()
+        return self.__connection
 
     #######################################################################
     #
@@ -446,18 +1182,34 @@ class BasePlugin:
     def onConnect(self, Connection, Status, Description):
         if (Connection == self.__connection):
             if (Status == 0):
-                Domoticz.Debug("Connected successfully to: " +
-                               Connection.Address+":"+Connection.Port)
+                Debug("Connected successfully to: %s:%s", Connection.Address, Connection.Port)
+                if(self.__connected_once):
+                    self.stats.reconnects += 1
+                self.__connected_once = True
+
+                # new stream, forget any partial frame and request of the previous one
+                self.__reassembler.reset()
+                self.__drop_requests()
 
-                self.__request_status()
+                for member in self.__group():
+                    member.__connected()
             else:
-                Domoticz.Debug("OnConnect Error Status: " + str(Status))
-                if(Status == 113):  # no route to host error (skip to avoid intempestive connect call)
-                    return
+                Debug("OnConnect Error Status: %s", Status)
                 if(self.__connection.Connected()):
                     self.__connection.Disconnect()
-                if(not self.__connection.Connecting()):
-                    self.__connection.Connect()
+                # the next poll reconnects once the backoff delay is over
+                self.__connection_failed()
+
+    # the connection is up: send what waited for it
+    def __connected(self):
+        if(self.__pending_dps):
+            # the status is requested after the changes
+            self.flush_updates(force=True)
+        elif(self.__status_wanted):
+            self.__status_wanted = False
+            self.__request_status()
+        else:
+            self.__poll_if_due(time.time())
 
     #######################################################################
     #
@@ -466,19 +1218,47 @@ class BasePlugin:
     #######################################################################
 
     def onMessage(self, Connection, Data):
-        Domoticz.Debug("onMessage called: " + Connection.Address +
-                       ":" + Connection.Port + " " + str(Data))
+        Debug("onMessage called: %s:%s %s", Connection.Address, Connection.Port, Data)
 
         if (Connection == self.__connection):
 
-            if(self.__state_machine == 0):  # skip nothing was waiting
-                return
+            if(self.__recorder):
+                self.__recorder.write(frame_log.RECEIVED, Data)
+
+            # a single read may hold several frames or only part of one
+            for frame in self.__reassembler.feed(Data):
+
+                if(self.__failures):
+                    self.__device_answered()
+
+                request = self.__match_request(frame)
+                if(request is not None):
+                    latency = time.time() - request.sent
+                    if(latency >= 0):  # not a late answer to a request still held by Delay
+                        self.stats.record(latency)
 
-            if(self.__state_machine == 1):  # after a set command: need to ask the status
-                self.__state_machine = 2
+                # error reply, the payload is a plain text message (e.g. "json obj data unvalid")
+                if(frame.retcode):
+                    Debug("Error %d from the device to cmd %d: %s", frame.retcode, frame.cmd, bytes(frame.payload))
+                    self.stats.error_replies += 1
+                    continue
 
-            if(self.__state_machine == 2):
-                self.__update_status(Data)
+                if(frame.cmd == tuya_protocol.CMD_HEART_BEAT):  # keep alive answer
+                    continue
+
+                # the device sends status frames on its own when a dps changes,
+                # a late answer still holds the current state
+                if(request is None and frame.cmd != tuya_protocol.CMD_STATUS):
+                    Debug("Unexpected frame %d cmd %d", frame.seqno, frame.cmd)
+
+                member, dps = self.__update_status(frame.payload)
+                if(member is None):
+                    member = request.owner if request is not None else self
+                now = time.time()
+                member.__check_echo(dps, now)
+                if(dps):
+                    polled = request is not None and request.cmd == tuya_protocol.CMD_DP_QUERY
+                    member.__adapt_poll(dps, polled, now)
 
     #######################################################################
     #
@@ -487,77 +1267,421 @@ class BasePlugin:
     #######################################################################
 
     def onCommand(self, Unit, Command, Level, Hue):
-        Domoticz.Debug("onCommand called for Unit " + str(Unit) +
-                       ": Parameter '" + str(Command) + "' Level: " + str(Level))
+        Debug("onCommand called for Unit %s: Parameter '%s' Level: %s", Unit, Command, Level)
 
         # onCommand called for Unit 2: Parameter 'Set Level' Level: 2.5
-        if (Unit == self.__thermostat_device) and (Command == "Set Level"):
-            Domoticz.Debug("onCommand current thermo: " +
-                           str(Devices[self.__thermostat_device]))
-            # thermostat setpoint control
-            self.__send_update('2', math.floor(2*Level/self.__multiplier))
-            # UpdateDevice(self.__thermostat_device, 0, str(Level))
-
-        elif (Unit == self.__control_device):
-            # thermostat on / off
-            if Command == 'Off':
-                request_status = False
-            elif Command == 'On':
-                request_status = True
-            else:
-                Domoticz.Error("Undefined command for unit " +
-                               Unit + ": " + Command)
-                return
+        encoder = self.__encoders.get(Unit - self.__base)
+        value = None
+        if encoder is not None:
+            dps, encode = encoder
+            value = encode(Command, Level)
 
-            self.__send_update('1', request_status)
-        elif (Unit == self.__mode_device) and (Command == "Set Level"):
-            if Level == 10:
-                # manual mode
-                request_status = '1'
-            elif Level == 20:
-                # device built in scheduler
-                request_status = '0'
-            else:
-                Domoticz.Error("Undefined command for unit " +
-                               Unit + ": " + Command)
-                return
+        if value is None:
+            Domoticz.Error("Undefined unit (" + str(Unit) +
+                           ") or command: '" + str(Command) + "' Level: " + str(Level))
+            return
 
-            self.__send_update('4', request_status)
-            # UpdateDevice(self.__mode_device, Level, str(Level))
-        elif (Unit == self.__eco_device) and (Command == "Set Level"):
-            if Level == 10:
-                # normal mode
-                request_status = False
-            elif Level == 20:
-                # eco mode
-                request_status = True
-            else:
-                Domoticz.Error("Undefined command for unit " +
-                               Unit + ": " + Command)
-                return
+        self.__queue_update(dps, value)
 
-            self.__send_update('5', request_status)
-            # UpdateDevice(self.__eco_device, Level, str(Level))
-        elif (Unit == self.__lock_device) and (Command == "Set Level"):
-            if Level == 10:
-                # unlocked
-                request_status = False
-            elif Level == 20:
-                # locked
-                request_status = True
-            else:
-                Domoticz.Error("Undefined command for unit " +
-                               Unit + ": " + Command)
-                return
+        # the device is being used, follow it closely
+        self.__poll_interval = self.__poll_min
+    #######################################################################
+    #
+    # onDisconnect Domoticz function
+    #
+    #######################################################################
+    def onDisconnect(self, Connection):
+        Debug("Disconnected from: %s:%s", Connection.Address, Connection.Port)
+        if (Connection == self.__connection):
+            self.__drop_requests()
+
+    #######################################################################
+    #
+    # onHeartbeat Domoticz function
+    #
+    #######################################################################
+    def onHeartbeat(self):
+        if(self.__recorder):
+            self.__recorder.flush()
+
+        if(self.__push_mode):
+            self.__keep_alive()
+            return
+
+        self.__poll_if_due(time.time())
+
+    #######################################################################
+    #
+    # stop
+    #    called from onStop
+    #
+    #######################################################################
+    def stop(self):
+        self.__device = None
+        self.__crypto = None
+        self.__payloads = None
+        self.__decoders = {}
+        self.__encoders = {}
+        if(self.__link is self and (self.__connection.Connected() or self.__connection.Connecting())):
+            self.__connection.Disconnect()
+        self.__connection = None
+        self.__link = self
+        self.__members = {}
+        self.__reassembler = None
+        self.__requests = {}
+        self.__pending_dps = {}
+        if(self.__recorder):
+            self.__recorder.close()
+            self.__recorder = None
+
+
+########################################################################################
+#
+# plugin object
+#    dispatches the Domoticz callbacks to the thermostats
+#
+########################################################################################
+
+
+class BasePlugin:
+
+    #######################################################################
+    #
+    # constant definition
+    #
+    #######################################################################
+    __FIRST_SHARED_UNIT = 249  # units from here on are not owned by a thermostat
+    __HEARTBEAT = Thermostat.TICK  # seconds between two heartbeats of the thermostats
+    __FAST_HEARTBEAT = 1  # heartbeat while writes wait for the end of the debounce window
+    __LATENCY_UNIT = 249  # custom sensor: average request to reply latency
+    __STATS_UNIT = 250  # text sensor: latency percentiles and error counters
+    __SNAPSHOT_INTERVAL = 600  # seconds between two saves of the state of the thermostats
+    __DISCOVERY_NAME = "Tuya discovery "  # name prefix of the UDP listeners, followed by the port
+    # options holding a number: type of their value
+    __NUMBER_OPTIONS = {"debounce": float, "poll_min": float, "poll_max": float, "backoff_max": float,
+                        "deadband": float, "min_write": float, "refresh": float, "silence": int,
+                        "stats": float, "snapshot": float, "record_max": int, "discovery_ttl": float}
+
+    #######################################################################
+    #
+    # constructor
+    #
+    #######################################################################
+    def __init__(self):
+        self.__thermostats = []  # Thermostat objects
+        self.__by_block = {}  # unit block -> Thermostat
+        self.__connections = {}  # Domoticz.Connection -> Thermostat
+        self.__heartbeat = self.__HEARTBEAT  # current Domoticz heartbeat interval
+        self.__last_tick = 0  # time of the last heartbeat of the thermostats
+        self.__stats_interval = 0  # seconds between two publications of the statistics, 0: off
+        self.__stats_file = None  # statistics are written to this file instead of sensors
+        self.__stats_due = 0  # time of the next publication
+        self.__snapshot_file = None  # state of the thermostats, restored by onStart
+        self.__snapshot_interval = self.__SNAPSHOT_INTERVAL
+        self.__snapshot_due = 0  # time of the next save
+        # discovery broadcasts: devID -> (IP, version), kept across restarts of the hardware
+        self.__discovery = tuya_discovery.DiscoveryIndex()
+        self.__discovery_connections = []  # UDP listeners
+        self.__by_dev_id = {}  # devID -> Thermostat
+        return
+
+    #######################################################################
+    #
+    # __discovered
+    #    a discovery broadcast: move a thermostat whose address changed
+    #
+    #######################################################################
+    def __discovered(self, Data):
+        info = tuya_discovery.decode_datagram(Data)
+        if info is None:
+            return
+        self.__discovery.update(info)
+        thermostat = self.__by_dev_id.get(info["gwId"])
+        if thermostat is not None:
+            self.__relocate(thermostat, str(info["ip"]), str(info.get("version", "")))
+
+    def __relocate(self, thermostat, address, version):
+        connection = thermostat.relocate(address, version)
+        if connection is not None:
+            # the old connection is forgotten, its late callbacks are ignored
+            self.__connections = {old: owner for old, owner in self.__connections.items() if owner is not thermostat}
+            self.__connections[connection] = thermostat
 
-            self.__send_update('6', request_status)
-            # UpdateDevice(self.__lock_device, Level, str(Level))
+    #######################################################################
+    #
+    # __save_snapshot
+    #    keep the state of the thermostats for the next start
+    #
+    #######################################################################
+    def __save_snapshot(self, now):
+        self.__snapshot_due = now + self.__snapshot_interval
+        if self.__snapshot_file and self.__thermostats:
+            WriteJson(self.__snapshot_file,
+                      {thermostat.dev_id(): thermostat.snapshot() for thermostat in self.__thermostats},
+                      separators=(',', ':'))
+
+    #######################################################################
+    #
+    # __publish_stats
+    #    network statistics of the last period to the sensors or the file
+    #
+    #######################################################################
+    def __publish_stats(self, now):
+        self.__stats_due = now + self.__stats_interval
+
+        total = NetworkStats()
+        devices = {}
+        for thermostat in self.__thermostats:
+            period = NetworkStats()
+            thermostat.collect_stats(period)
+            total.add(period)
+            devices[thermostat.dev_id()] = period
+
+        if self.__stats_file:
+            report = {"time": int(now), "period": self.__stats_interval,
+                      "total": total.as_dict(),
+                      "devices": {dev_id: stats.as_dict() for dev_id, stats in devices.items()}}
+            WriteJson(self.__stats_file, report, indent=1)
+            return
+
+        UpdateDevice(self.__LATENCY_UNIT, 0, str(round(total.average(), 1)))
+        UpdateDevice(self.__STATS_UNIT, 0, total.summary())
+
+    #######################################################################
+    #
+    # __update_heartbeat
+    #    speed up the Domoticz heartbeat while writes are buffered
+    #
+    #######################################################################
+    def __update_heartbeat(self):
+        heartbeat = self.__HEARTBEAT
+        if any(thermostat.has_pending_updates() for thermostat in self.__thermostats):
+            heartbeat = self.__FAST_HEARTBEAT
+
+        if heartbeat != self.__heartbeat:
+            self.__heartbeat = heartbeat
+            Domoticz.Heartbeat(heartbeat)
+
+    #######################################################################
+    #
+    # __load_entries
+    #    thermostats configured in the hardware settings
+    #
+    #######################################################################
+    def __load_entries(self, options):
+
+        if "inventory" in options:
+            return inventory.load_inventory(options["inventory"])
+
+        # Address, DevID and Local Key may hold ';' separated lists; a local
+        # key may contain ';' itself, the field is only a list for several devIDs
+        addresses = SplitList(Parameters["Address"])
+        dev_ids = SplitList(Parameters["Mode1"])
+        local_keys = SplitList(Parameters["Mode2"]) if len(dev_ids) > 1 else [Parameters["Mode2"]]
+        if not (len(addresses) == len(dev_ids) == len(local_keys)):
+            Domoticz.Error("IP address, DevID and Local Key lists must have the same length" +
+                           " (use the inventory option when a local key holds ';')")
+            return []
+
+        version = "3.3" if Parameters["Mode3"] == "2" else "3.1"
+        single = len(dev_ids) == 1
+        entries = []
+        for address, dev_id, local_key in zip(addresses, dev_ids, local_keys):
+            entry = {"name": "" if single else dev_id,
+                     "address": address,
+                     "dev_id": dev_id,
+                     "local_key": local_key,
+                     "version": version}
+            # <gateway devID>/<cid>: sub-device behind a gateway
+            gateway, _, cid = dev_id.partition("/")
+            if cid:
+                entry.update(dev_id=gateway, cid=cid)
+            entries.append(entry)
+        return entries
+
+    #######################################################################
+    #
+    # __assign_blocks
+    #    block of units of each thermostat, kept in units_<hardware id>.json
+    #    so that the Domoticz devices stay with their thermostat when the
+    #    list changes. New thermostats get the free blocks; the block of a
+    #    removed thermostat is only freed once its devices are deleted.
+    #
+    # Returns [(block, entry)]
+    #
+    #######################################################################
+    def __assign_blocks(self, entries):
+        max_devices = (self.__FIRST_SHARED_UNIT - 1) // Thermostat.UNITS_PER_DEVICE
+        path = os.path.join(Parameters.get("HomeFolder", ""),
+                            "units_" + str(Parameters.get("HardwareID", "")) + ".json")
+        saved = ReadJson(path)
+        if isinstance(saved, dict):
+            blocks = {key: block for key, block in saved.items()
+                      if isinstance(block, int) and 0 <= block < max_devices}
         else:
-            Domoticz.Error("Undefined unit (" + str(Unit) +
-                           ") or command: '" + str(Command) + "' Level: " + str(Level))
+            # first start, the blocks used to follow the order of the list
+            blocks = {}
+            for index, entry in enumerate(entries[:max_devices]):
+                blocks.setdefault(EntryKey(entry), index)
+
+        configured = set(EntryKey(entry) for entry in entries)
+        for key, block in list(blocks.items()):
+            first = block * Thermostat.UNITS_PER_DEVICE + 1
+            if key not in configured and not any(unit in Devices for unit in
+                                                 range(first, first + Thermostat.UNITS_PER_DEVICE)):
+                del blocks[key]
+
+        used = set(blocks.values())
+        listed = set()
+        result = []
+        for entry in entries:
+            key = EntryKey(entry)
+            if key in listed:
+                Domoticz.Error(key + " is listed twice, ignoring the second entry")
+                continue
+            listed.add(key)
+            if key not in blocks:
+                free = [block for block in range(max_devices) if block not in used]
+                if not free:
+                    Domoticz.Error("Only " + str(max_devices) + " thermostats per hardware are supported, ignoring " + key)
+                    continue
+                blocks[key] = free[0]
+                used.add(free[0])
+            result.append((blocks[key], entry))
+
+        if blocks != saved:
+            WriteJson(path, blocks, indent=1)
+        return result
+
+    #######################################################################
+    #
+    # onStart Domoticz function
+    #
+    #######################################################################
+    def onStart(self):
+
+        # Debug mode
+        SetDebugging(int(Parameters["Mode6"]) & 255)
+        Debug("onStart called")
+
+        # get parameters
+        multiplier = float(Parameters["Mode4"])
+        options = ParseOptions(Parameters["Mode5"])
+
+        # a missing inventory or a bad number stops the plugin before any connection is opened
+        try:
+            CheckOptions(options, self.__NUMBER_OPTIONS)
+            entries = self.__load_entries(options)
+            for entry in entries:
+                # the model of the entry wins over the model option
+                model = entry.get("model") or options.get("model", thermostat_models.DEFAULT_MODEL)
+                if model not in thermostat_models.MODELS:
+                    raise ValueError("unknown thermostat model " + model + " for " + entry["dev_id"])
+        except (OSError, ValueError) as e:
+            Domoticz.Error("Invalid configuration, the plugin is not started: " + str(e))
             return
 
-        self.__request_status()
+        blocks = self.__assign_blocks(entries)
+
+        # state saved by the previous run, one file per hardware
+        self.__snapshot_interval = float(options.get("snapshot", self.__SNAPSHOT_INTERVAL))
+        self.__snapshot_file = None
+        saved = {}
+        if self.__snapshot_interval > 0:
+            self.__snapshot_file = os.path.join(Parameters.get("HomeFolder", ""),
+                                                "snapshot_" + str(Parameters.get("HardwareID", "")) + ".json")
+            saved = ReadJson(self.__snapshot_file)
+            if not isinstance(saved, dict):
+                saved = {}
+
+        # listen to the discovery broadcasts, "1" for the default ports or ports separated by ','
+        discovery = options.get("discovery", "0")
+        if discovery != "0":
+            self.__discovery.ttl = float(options.get("discovery_ttl", tuya_discovery.DiscoveryIndex.TTL))
+            ports = tuya_discovery.DISCOVERY_PORTS if discovery == "1" else SplitList(discovery.replace(",", ";"))
+            for port in ports:
+                connection = Domoticz.Connection(Name=self.__DISCOVERY_NAME + str(port), Transport="UDP/IP",
+                                                 Address="0.0.0.0", Port=str(port))
+                connection.Listen()
+                self.__discovery_connections.append(connection)
+
+        gateways = {}  # (address, devID) -> thermostat holding the connection of a gateway
+        for block, entry in blocks:
+            # an address discovered before a restart of the hardware is more recent
+            found = self.__discovery.lookup(entry["dev_id"])
+            if found is not None:
+                port = entry["address"].partition(":")[2]
+                entry = dict(entry, address=found[0] + (":" + port if port else ""),
+                             version=found[1] if found[1] in ("3.1", "3.3") else entry["version"])
+            thermostat = Thermostat(block, entry)
+            self.__thermostats.append(thermostat)
+            self.__by_block[block] = thermostat
+
+            # the sub-devices of a gateway share the connection of the first one
+            if entry.get("cid"):
+                owner = gateways.setdefault((entry["address"], entry["dev_id"]), thermostat)
+                if owner is not thermostat:
+                    thermostat.attach(owner)
+                    thermostat.start(multiplier, options, saved.get(thermostat.dev_id()))
+                    continue
+
+            self.__by_dev_id[entry["dev_id"]] = thermostat
+            self.__connections[thermostat.start(multiplier, options, saved.get(thermostat.dev_id()))] = thermostat
+
+        # network statistics, published every stats seconds
+        self.__stats_interval = float(options.get("stats", 0))
+        self.__stats_file = options.get("stats_file")
+        if self.__stats_interval > 0 and not self.__stats_file:
+            if self.__LATENCY_UNIT not in Devices:
+                Domoticz.Device(Name="Latency", Unit=self.__LATENCY_UNIT, TypeName="Custom",
+                                Options={"Custom": "1;ms"}, Used=0).Create()
+            if self.__STATS_UNIT not in Devices:
+                Domoticz.Device(Name="Network", Unit=self.__STATS_UNIT, TypeName="Text",
+                                Used=0).Create()
+
+        self.__last_tick = time.time()
+        self.__stats_due = self.__last_tick + self.__stats_interval
+        self.__snapshot_due = self.__last_tick + self.__snapshot_interval
+        Domoticz.Heartbeat(self.__heartbeat)
+
+    #######################################################################
+    #
+    # onConnect Domoticz function
+    #
+    #######################################################################
+    def onConnect(self, Connection, Status, Description):
+        thermostat = self.__connections.get(Connection)
+        if thermostat is not None:
+            Profiled(("onConnect", thermostat.dev_id()), thermostat.onConnect, Connection, Status, Description)
+
+    #######################################################################
+    #
+    # onMessage Domoticz function
+    #
+    #######################################################################
+    def onMessage(self, Connection, Data):
+        # Domoticz hands each datagram over in a new Connection (Address and
+        # Port of the sender), only the Name of the listener is kept
+        if self.__discovery_connections and Connection.Name.startswith(self.__DISCOVERY_NAME):
+            self.__discovered(Data)
+            return
+        thermostat = self.__connections.get(Connection)
+        if thermostat is not None:
+            Profiled(("onMessage", thermostat.dev_id()), thermostat.onMessage, Connection, Data)
+
+    #######################################################################
+    #
+    # onCommand Domoticz function
+    #
+    #######################################################################
+    def onCommand(self, Unit, Command, Level, Hue):
+        thermostat = self.__by_block.get((Unit - 1) // Thermostat.UNITS_PER_DEVICE)
+        if thermostat is not None:
+            Profiled(("onCommand", thermostat.dev_id()), thermostat.onCommand, Unit, Command, Level, Hue)
+            self.__update_heartbeat()
+        else:
+            Domoticz.Error("Undefined unit (" + str(Unit) +
+                           ") or command: '" + str(Command) + "' Level: " + str(Level))
 
     #######################################################################
     #
@@ -565,8 +1689,9 @@ class BasePlugin:
     #
     #######################################################################
     def onDisconnect(self, Connection):
-        Domoticz.Debug("Disconnected from: " +
-                       Connection.Address+":"+Connection.Port)
+        thermostat = self.__connections.get(Connection)
+        if thermostat is not None:
+            thermostat.onDisconnect(Connection)
 
     #######################################################################
     #
@@ -574,9 +1699,24 @@ class BasePlugin:
     #
     #######################################################################
     def onHeartbeat(self):
-        self.__runAgain -= 1
-        if(self.__runAgain == 0):
-            self.__request_status()
+        now = time.time()
+        for thermostat in self.__thermostats:
+            thermostat.check_requests(now)
+            thermostat.flush_updates(now)
+
+        # the heartbeat may be faster than the thermostats expect
+        if now - self.__last_tick >= self.__HEARTBEAT - self.__FAST_HEARTBEAT / 2:
+            self.__last_tick = now
+            for thermostat in self.__thermostats:
+                Profiled(("onHeartbeat", thermostat.dev_id()), thermostat.onHeartbeat)
+
+            if self.__stats_interval > 0 and now >= self.__stats_due:
+                self.__publish_stats(now)
+
+            if self.__snapshot_file and now >= self.__snapshot_due:
+                self.__save_snapshot(now)
+
+        self.__update_heartbeat()
 
     #######################################################################
     #
@@ -584,13 +1724,16 @@ class BasePlugin:
     #
     #######################################################################
     def onStop(self):
-        self.__device = None
-        self.__control_device = None
-        self.__thermostat_device = None
-        if(self.__connection.Connected() or self.__connection.Connecting()):
-            self.__connection.Disconnect()
-        self.__connection = None
-        self.__state_machine = 0
+        self.__save_snapshot(time.time())
+        for thermostat in self.__thermostats:
+            thermostat.stop()
+        self.__thermostats = []
+        self.__by_block = {}
+        self.__connections = {}
+        self.__by_dev_id = {}
+        for connection in self.__discovery_connections:
+            connection.Disconnect()
+        self.__discovery_connections = []
 
 
 ########################################################################################
@@ -604,37 +1747,39 @@ _plugin = BasePlugin()
 
 def onStart():
     global _plugin
-    _plugin.onStart()
+    SetProfiling(int(Parameters["Mode6"]) & 256)
+    Profiled("onStart", _plugin.onStart)
 
 
 def onStop():
     global _plugin
-    _plugin.onStop()
+    Profiled("onStop", _plugin.onStop)
+    SetProfiling(0)
 
 
 def onConnect(Connection, Status, Description):
     global _plugin
-    _plugin.onConnect(Connection, Status, Description)
+    Profiled("onConnect", _plugin.onConnect, Connection, Status, Description)
 
 
 def onMessage(Connection, Data):
     global _plugin
-    _plugin.onMessage(Connection, Data)
+    Profiled("onMessage", _plugin.onMessage, Connection, Data)
 
 
 def onCommand(Unit, Command, Level, Hue):
     global _plugin
-    _plugin.onCommand(Unit, Command, Level, Hue)
+    Profiled("onCommand", _plugin.onCommand, Unit, Command, Level, Hue)
 
 
 def onDisconnect(Connection):
     global _plugin
-    _plugin.onDisconnect(Connection)
+    Profiled("onDisconnect", _plugin.onDisconnect, Connection)
 
 
 def onHeartbeat():
     global _plugin
-    _plugin.onHeartbeat()
+    Profiled("onHeartbeat", _plugin.onHeartbeat)
 
 ################################################################################
 # Generic helper functions
@@ -647,5 +1792,96 @@ def UpdateDevice(Unit, nValue, sValue, TimedOut=0, AlwaysUpdate=False):
         if Devices[Unit].nValue != nValue or Devices[Unit].sValue != sValue or Devices[Unit].TimedOut != TimedOut or AlwaysUpdate:
             Devices[Unit].Update(
                 nValue=nValue, sValue=str(sValue), TimedOut=TimedOut)
-            Domoticz.Debug(
-                "Update " + Devices[Unit].Name + ": " + str(nValue) + " - '" + str(sValue) + "'")
+            Debug("Update %s: %s - '%s'", Devices[Unit].Name, nValue, sValue)
+
+
+# debug messages are only formatted when Domoticz.Debug() calls are shown
+_debugging = False
+
+
+def SetDebugging(Mask):
+    global _debugging
+    Domoticz.Debugging(Mask)
+    _debugging = (Mask & 3) != 0  # 1: all, 2: Domoticz.Debug() calls
+
+
+def Debug(Message, *Args):
+    # Args are formatted into Message only when debugging, raw buffers included
+    if _debugging:
+        if Args:
+            Message = Message % tuple(bytes(arg) if isinstance(arg, memoryview) else arg for arg in Args)
+        Domoticz.Debug(Message)
+
+
+# profiler of the callbacks, None unless the Debug field is set to profile
+_profiler = None
+
+
+def SetProfiling(Enabled):
+    global _profiler
+    if _profiler is not None:
+        _profiler.dump()
+        _profiler = None
+    if Enabled:
+        _profiler = Profiler(Parameters.get("HomeFolder", ""))
+
+
+def Profiled(Key, Function, *Args):
+    if _profiler is None:
+        return Function(*Args)
+    return _profiler.call(Key, Function, Args)
+
+
+def WriteJson(Path, Data, **Args):
+    # replace the file at once, a reader never sees half of it
+    try:
+        temporary = Path + ".tmp"
+        with open(temporary, "w") as file:
+            json.dump(Data, file, **Args)
+        os.replace(temporary, Path)
+        return True
+    except (OSError, TypeError, ValueError) as e:
+        Domoticz.Error("Cannot write " + Path + ": " + str(e))
+        return False
+
+
+def ReadJson(Path):
+    # None when the file is missing or damaged
+    try:
+        with open(Path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        Domoticz.Error("Cannot read " + Path + ": " + str(e))
+        return None
+
+
+def EntryKey(Entry):
+    # devID of an entry, followed by /cid for a sub-device of a gateway (see Thermostat.dev_id)
+    return Entry["dev_id"] + "/" + Entry["cid"] if Entry.get("cid") else Entry["dev_id"]
+
+
+def SplitList(Value):
+    # "a;b;c" as entered in the IP address, DevID and Local Key fields
+    return [item.strip() for item in Value.split(';') if item.strip()]
+
+
+def ParseOptions(Options):
+    # "key=value;key=value" as entered in the Options field
+    result = {}
+    for option in Options.split(';'):
+        if '=' in option:
+            key, value = option.split('=', 1)
+            result[key.strip()] = value.strip()
+    return result
+
+
+def CheckOptions(Options, Types):
+    # raise ValueError when an option of Types does not hold a valid number
+    for key, kind in Types.items():
+        if key in Options:
+            try:
+                kind(Options[key])
+            except ValueError:
+                raise ValueError("option " + key + " is not a valid number: " + Options[key])
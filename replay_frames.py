@@ -0,0 +1,186 @@
+#!/usr/bin/python3
+
+########################################################################################
+#     Domoticz Tuya Smart Plug Python Plugin                                              #
+#                                                                                      #
+#     MIT License                                                                        #
+#                                                                                      #
+#    Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#    Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#    of this software and associated documentation files (the "Software"), to deal      #
+#    in the Software without restriction, including without limitation the rights       #
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#    copies of the Software, and to permit persons to whom the Software is              #
+#    furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#    The above copyright notice and this permission notice shall be included in all     #
+#    copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#    SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+# Replay of a frame log written by the plugin 'record' option.
+#
+# usage: replay_frames.py frames_ID.log --local-key KEY [--print]
+#        replay_frames.py frames_ID.log --local-key KEY --to 127.0.0.1:6668
+#
+# By default the data received from the thermostat is fed to the plugin
+# (with stubbed Domoticz objects, as bench_decode.py does), through
+# onMessage and the status decoding. With --to, the frames the plugin sent
+# are sent again to a device, typically tuya_simulator.py. --speed 1
+# keeps the original timing, 0 (the default) replays as fast as possible.
+# The rotated parts of the log (.1, .2 ...) are replayed first.
+
+import argparse
+import json
+import socket
+import sys
+import time
+
+import bench_decode
+import frame_log
+import tuya_protocol
+
+
+########################################################################################
+#
+# Pacer
+#    wait between the records to keep their original spacing
+#
+########################################################################################
+class Pacer:
+
+    def __init__(self, speed):
+        self.speed = speed
+        self.origin = None  # (log time, wall time) of the first record
+
+    def wait(self, timestamp):
+        if self.speed <= 0:
+            return
+        if self.origin is None:
+            self.origin = (timestamp, time.monotonic())
+            return
+        delay = (timestamp - self.origin[0]) / self.speed - (time.monotonic() - self.origin[1])
+        if delay > 0:
+            time.sleep(delay)
+
+
+def records(path):
+    for part in frame_log.log_files(path):
+        for record in frame_log.read_log(part):
+            yield record
+
+
+########################################################################################
+#
+# describe
+#    one line per frame: time, direction, seqno, command and decrypted payload
+#
+########################################################################################
+def describe(crypto, timestamp, direction, frame):
+    try:
+        payload = tuya_protocol.decrypt_payload(crypto, frame.payload)
+    except ValueError:
+        payload = bytes(frame.payload)
+    return "%.3f %s seq %d cmd 0x%02x %s" % (timestamp, "<" if direction == frame_log.RECEIVED else ">",
+                                            frame.seqno, frame.cmd, payload.decode("utf-8", "replace"))
+
+
+def replay_to_plugin(args, header):
+    bench_decode.DEV_ID = header["dev_id"]
+    bench_decode.LOCAL_KEY = args.local_key
+    plugin, connection = bench_decode.load_plugin(float(header["version"]), args.model or header.get("model", "BHT-002"))
+    crypto = tuya_protocol.CryptoContext(args.local_key)
+    reassemblers = {frame_log.RECEIVED: tuya_protocol.FrameReassembler(),
+                    frame_log.SENT: tuya_protocol.FrameReassembler(has_retcode=False)}
+    pacer = Pacer(args.speed)
+
+    count = size = 0
+    start = time.perf_counter()
+    for timestamp, direction, data in records(args.log):
+        if args.print:
+            for frame in reassemblers[direction].feed(data):
+                print(describe(crypto, timestamp, direction, frame))
+        if direction != frame_log.RECEIVED:
+            continue
+        pacer.wait(timestamp)
+        plugin.onMessage(connection, data)
+        count += 1
+        size += len(data)
+    elapsed = time.perf_counter() - start
+
+    print("%d reads (%d bytes) replayed in %.3fs" % (count, size, elapsed))
+    print("devices: " + json.dumps({unit: device.sValue for unit, device in plugin.Devices.items()}))
+
+
+def replay_to_device(args, header):
+    host, _, port = args.to.partition(":")
+    sock = socket.create_connection((host, int(port or 6668)), timeout=5)
+    sock.setblocking(False)
+    reassembler = tuya_protocol.FrameReassembler()
+    pacer = Pacer(args.speed)
+
+    def drain():
+        replies = 0
+        try:
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                replies += len(reassembler.feed(data))
+        except BlockingIOError:
+            pass
+        return replies
+
+    sent = replies = 0
+    start = time.perf_counter()
+    for timestamp, direction, data in records(args.log):
+        if direction != frame_log.SENT:
+            continue
+        pacer.wait(timestamp)
+        sock.sendall(data)
+        sent += 1
+        replies += drain()
+
+    # answers still on their way
+    deadline = time.monotonic() + args.wait
+    while time.monotonic() < deadline and replies < sent:
+        time.sleep(0.05)
+        replies += drain()
+    sock.close()
+    print("%d frames sent to %s in %.3fs, %d frames received" % (sent, args.to, time.perf_counter() - start, replies))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay of a frame log of the plugin")
+    parser.add_argument("log", help="log file written by the record option")
+    parser.add_argument("--local-key", required=True, help="local key of the thermostat")
+    parser.add_argument("--to", help="send the recorded requests to this ip:port instead of the plugin")
+    parser.add_argument("--speed", type=float, default=0.0, help="1: original timing, 0: as fast as possible")
+    parser.add_argument("--model", help="thermostat model, default is the one of the log")
+    parser.add_argument("--print", action="store_true", help="print the decrypted frames")
+    parser.add_argument("--wait", type=float, default=2.0, help="--to: seconds to wait for the last answers")
+    args = parser.parse_args()
+
+    try:
+        header = frame_log.read_header(frame_log.log_files(args.log)[0])
+    except (IndexError, OSError, ValueError) as e:
+        print("Cannot read %s: %s" % (args.log, e))
+        sys.exit(1)
+
+    if args.to:
+        replay_to_device(args, header)
+    else:
+        replay_to_plugin(args, header)
+
+
+if __name__ == "__main__":
+    main()
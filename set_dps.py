@@ -31,38 +31,173 @@ import sys
 import pytuya
 import socket  # needed for socket.timeout exception
 import logging
+import argparse
+import asyncio
+import json
 
-logging.basicConfig(level=logging.DEBUG)
+import inventory
+import tuya_client
+
+DPS_TYPES = ("bool", "number", "string")
 
-if(len(sys.argv) != 8):
+
+def usage():
     print("usage: " + sys.argv[0] +
           " <IP> <DevID> <Local key> <version> <DPS key> <DPS value> <DPS type>")
+    print("       " + sys.argv[0] +
+          " <IP> <DevID> <Local key> <version> <DPS key>=<DPS value>[:<DPS type>] ...")
+    print("       " + sys.argv[0] +
+          " --batch <file or -> [--inventory <file>] [--timeout <seconds>] [--concurrency <n>]")
     print("    <DPS type>: " +
           "\n       bool - a boolean value" +
           "\n       number - a numerical value value" +
-          "\n       string - a string value value")
+          "\n       string - a string value value" +
+          "\n       (key=value without type: bool for true/false, number for integers, string otherwise)")
     exit(1)
 
-ip = sys.argv[1]
+
+def format_dps_value(dps_value, dps_type):
+    if (dps_type == "bool"):
+        return dps_value.lower() == "true"
+    if (dps_type == "number"):
+        return int(dps_value)
+    return str(dps_value)
+
+
+def parse_assignment(text):
+    # "key=value:type" -> (key, formatted value)
+    dps_key, sep, dps_value = text.partition("=")
+    if not sep or not dps_key:
+        raise ValueError("expected <DPS key>=<DPS value>[:<DPS type>], got '" + text + "'")
+    value, _, dps_type = dps_value.rpartition(":")
+    if dps_type not in DPS_TYPES:
+        value = dps_value
+        if dps_value.lower() in ("true", "false"):
+            dps_type = "bool"
+        else:
+            try:
+                int(dps_value)
+                dps_type = "number"
+            except ValueError:
+                dps_type = "string"
+    return str(dps_key), format_dps_value(value, dps_type)
+
+
+def parse_assignments(texts):
+    return dict(parse_assignment(text) for text in texts)
+
+
+########################################################################################
+#
+# batch mode
+#    one write job per line, the jobs run in parallel
+#
+#    with --inventory:  <name or DevID> <DPS key>=<DPS value>[:<DPS type>] ...
+#    without:           <IP> <DevID> <Local key> <version> <DPS key>=<DPS value>[:<DPS type>] ...
+#
+#    Empty lines and lines starting with # are ignored. One json line is
+#    printed per job when it succeeds or fails.
+#
+########################################################################################
+def read_jobs(lines, devices):
+    jobs = []
+    for number, line in enumerate(lines, 1):
+        words = line.split()
+        if not words or words[0].startswith("#"):
+            continue
+        try:
+            if devices is not None:
+                if words[0] not in devices:
+                    raise ValueError("unknown device '" + words[0] + "'")
+                entry, assignments = devices[words[0]], words[1:]
+            else:
+                if len(words) < 5:
+                    raise ValueError("expected <IP> <DevID> <Local key> <version> <DPS key>=<DPS value> ...")
+                entry = {"name": words[1], "address": words[0], "dev_id": words[1],
+                         "local_key": words[2], "version": words[3]}
+                assignments = words[4:]
+            if not assignments:
+                raise ValueError("no dps to set")
+            jobs.append(dict(entry, dps=parse_assignments(assignments)))
+        except ValueError as e:
+            print("line " + str(number) + ": " + str(e))
+            exit(1)
+    return jobs
+
+
+def batch(args):
+    parser = argparse.ArgumentParser(prog=sys.argv[0] + " --batch",
+                                     description="write dps to many thermostats in parallel")
+    parser.add_argument("--batch", required=True, help="file of write jobs, - for stdin")
+    parser.add_argument("--inventory", help="JSON or CSV inventory, jobs then name the thermostats")
+    parser.add_argument("--timeout", type=float, default=5.0, help="seconds given to each thermostat")
+    parser.add_argument("--concurrency", type=int, default=64, help="thermostats written at the same time")
+    args = parser.parse_args(args)
+
+    devices = None
+    try:
+        if args.inventory:
+            devices = {}
+            for entry in inventory.load_inventory(args.inventory):
+                devices[entry["dev_id"]] = entry
+                devices[entry["name"]] = entry
+        if args.batch == "-":
+            jobs = read_jobs(sys.stdin, devices)
+        else:
+            with open(args.batch) as f:
+                jobs = read_jobs(f, devices)
+    except (OSError, ValueError) as e:
+        print("Cannot read the jobs: " + str(e))
+        exit(1)
+
+    async def write(job, link):
+        return await tuya_client.exchange(job, "set", job["dps"], timeout=args.timeout, link=link)
+
+    async def run():
+        failed = 0
+        async for job, result, error, elapsed in tuya_client.run_all(jobs, write, args.concurrency):
+            line = {"name": job["name"], "address": job["address"], "dev_id": job["dev_id"],
+                    "dps": job["dps"], "ok": error is None, "latency_ms": int(elapsed * 1000)}
+            if error is not None:
+                line["error"] = error
+                failed += 1
+            print(json.dumps(line), flush=True)
+        return failed
+
+    exit(1 if asyncio.run(run()) else 0)
+
+
+if(len(sys.argv) > 1 and sys.argv[1].startswith("--")):
+    batch(sys.argv[1:])
+
+if(len(sys.argv) < 6):
+    usage()
+
+logging.basicConfig(level=logging.DEBUG)
+
+ip, _, port = sys.argv[1].partition(':')  # <IP> may be <IP>:<port>
 devid = sys.argv[2]
 localkey = sys.argv[3]
-dps_key = sys.argv[5]
-dps_value = sys.argv[6]
-dps_type = sys.argv[7]
+
+try:
+    if(len(sys.argv) == 8 and "=" not in sys.argv[5]):
+        # <DPS key> <DPS value> <DPS type>
+        dps = {str(sys.argv[5]): format_dps_value(sys.argv[6], sys.argv[7])}
+    else:
+        dps = parse_assignments(sys.argv[5:])
+except ValueError as e:
+    print(str(e))
+    usage()
 
 device = pytuya.OutletDevice(devid, ip, localkey)
-device.version = sys.argv[4]
+if port:
+    device.port = int(port)
+device.version = float(sys.argv[4])
 
 try:
 
-    formatted_dps_value = str(dps_value)
-    if (dps_type == "bool"):
-        formatted_dps_value = (dps_value.lower() == "true")
-    if (dps_type == "number"):
-        formatted_dps_value = int(dps_value)
-
-    payload = device.generate_payload(
-        'set', {str(dps_key): formatted_dps_value})
+    # all the dps are set by a single payload
+    payload = device.generate_payload('set', dps)
     device._send_receive(payload)
 
 except (ConnectionResetError, socket.timeout, OSError) as e:
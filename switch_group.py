@@ -0,0 +1,107 @@
+#!/usr/bin/python3
+
+########################################################################################
+#     Domoticz Tuya Smart Plug Python Plugin                                              #
+#                                                                                      #
+#     MIT License                                                                        #
+#                                                                                      #
+#    Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#    Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#    of this software and associated documentation files (the "Software"), to deal      #
+#    in the Software without restriction, including without limitation the rights       #
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#    copies of the Software, and to permit persons to whom the Software is              #
+#    furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#    The above copyright notice and this permission notice shall be included in all     #
+#    copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#    SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+# Switch a group of thermostats on or off.
+#
+# usage: switch_group.py <inventory> <group> on|off [--timeout <seconds>] [--retries <n>]
+#
+# The members of the group are the inventory entries listing it in their
+# 'groups' field. They are all switched at once, each one with its own
+# protocol version and the On / Off dps of its model; the members that
+# did not answer are tried again. Replaces turnON.py and turnOFF.py.
+
+import argparse
+import asyncio
+import json
+import sys
+
+import inventory
+import thermostat_models
+import tuya_client
+
+
+async def switch(members, state, args):
+    async def write(entry, link):
+        dps = thermostat_models.power_dps(entry.get("model", thermostat_models.DEFAULT_MODEL))
+        return await tuya_client.exchange(entry, "set", {dps: state}, timeout=args.timeout, link=link)
+
+    def key(entry):
+        return entry["dev_id"], entry.get("cid")  # sub-devices share the devID of their gateway
+
+    pending = members
+    failed = {}
+    for attempt in range(args.retries + 1):
+        stragglers = []
+        async for entry, result, error, elapsed in tuya_client.run_all(pending, write, args.concurrency):
+            if error is None:
+                failed.pop(key(entry), None)
+                print(json.dumps({"name": entry["name"], "dev_id": entry["dev_id"], "ok": True,
+                                  "attempts": attempt + 1, "latency_ms": int(elapsed * 1000)}), flush=True)
+            else:
+                failed[key(entry)] = error
+                stragglers.append(entry)
+        if not stragglers:
+            break
+        pending = stragglers
+
+    for entry in pending:
+        if key(entry) in failed:
+            print(json.dumps({"name": entry["name"], "dev_id": entry["dev_id"], "ok": False,
+                              "attempts": args.retries + 1, "error": failed[key(entry)]}), flush=True)
+    return len(failed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Switch a group of thermostats on or off")
+    parser.add_argument("inventory", help="JSON or CSV inventory file")
+    parser.add_argument("group", help="group name, as listed in the groups field of the inventory")
+    parser.add_argument("state", choices=("on", "off"))
+    parser.add_argument("--timeout", type=float, default=3.0, help="seconds given to each attempt")
+    parser.add_argument("--retries", type=int, default=2, help="attempts again for the members that failed")
+    parser.add_argument("--concurrency", type=int, default=64, help="thermostats switched at the same time")
+    args = parser.parse_args()
+
+    try:
+        members = inventory.group_members(inventory.load_inventory(args.inventory), args.group)
+        for entry in members:
+            thermostat_models.power_dps(entry.get("model", thermostat_models.DEFAULT_MODEL))
+    except (OSError, ValueError) as e:
+        print("Cannot read the inventory: " + str(e))
+        sys.exit(1)
+
+    if not members:
+        print("No thermostat in group '" + args.group + "'")
+        sys.exit(1)
+
+    sys.exit(1 if asyncio.run(switch(members, args.state == "on", args)) else 0)
+
+
+if __name__ == "__main__":
+    main()
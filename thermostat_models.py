@@ -0,0 +1,196 @@
+########################################################################################
+#     Domoticz Tuya Smart Plug Python Plugin                                              #
+#                                                                                      #
+#     MIT License                                                                        #
+#                                                                                      #
+#    Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#    Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#    of this software and associated documentation files (the "Software"), to deal      #
+#    in the Software without restriction, including without limitation the rights       #
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#    copies of the Software, and to permit persons to whom the Software is              #
+#    furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#    The above copyright notice and this permission notice shall be included in all     #
+#    copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#    SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+# Declarative description of the supported thermostat models.
+#
+# Each model is a list of dps. A dps is bound to a Domoticz unit of the
+# thermostat block (offset 1 is the first unit of the block) and has a
+# kind telling how its value is shown in Domoticz:
+#
+#   switch:      bool dps, On / Off switch
+#   temperature: numeric dps, value / divisor * resolution; with
+#                setpoint=True the unit is a setpoint that can be written
+#   selector:    dps with a few values, each one shown as a selector level
+#                (levels: {level: dps value}); default is the level of
+#                unknown values
+#
+# "device" holds the arguments of Domoticz.Device used to create the unit.
+# Adding a model is only a matter of adding an entry to MODELS.
+
+import math
+
+DEFAULT_MODEL = "BHT-002"
+
+
+def _selector_options(names):
+    return {"LevelActions": "|" * (len(names) - 1),
+            "LevelNames": "|".join(names),
+            "LevelOffHidden": "true",
+            "SelectorStyle": "0"}
+
+
+_POWER = {"dps": "1", "unit": 1, "kind": "switch", "name": "Control",
+          "device": {"TypeName": "Switch", "Used": 1}}
+
+_SETPOINT = {"dps": "2", "unit": 2, "kind": "temperature", "divisor": 2, "setpoint": True, "name": "Setpoint",
+             "device": {"Type": 242, "Subtype": 1, "Used": 1}}
+
+_SCHEDULE = {"dps": "4", "unit": 3, "kind": "selector", "levels": {10: "1", 20: "0"}, "default": 20,
+             "name": "Operating Mode",
+             "device": {"TypeName": "Selector Switch", "Switchtype": 18,
+                        "Options": _selector_options(["Off", "Manual", "Schedule"])}}
+
+_LOCK = {"dps": "6", "unit": 4, "kind": "selector", "levels": {10: False, 20: True}, "default": 20,
+         "name": "Key Lock",
+         "device": {"TypeName": "Selector Switch", "Switchtype": 18,
+                    "Options": _selector_options(["Off", "Unlocked", "Locked"])}}
+
+_ECO = {"dps": "5", "unit": 5, "kind": "selector", "levels": {10: False, 20: True}, "default": 20,
+        "name": "Eco Mode",
+        "device": {"TypeName": "Selector Switch", "Switchtype": 18,
+                   "Options": _selector_options(["Off", "Normal", "Eco"])}}
+
+_TEMPERATURE = {"dps": "3", "unit": 6, "kind": "temperature", "divisor": 2, "name": "Temperature",
+                "device": {"TypeName": "Temperature", "Used": 1}}
+
+MODELS = {
+    # floor heating thermostat (16A-002HB-WiFi, 16A-002BB-WiFi, ...)
+    "BHT-002": [
+        _POWER, _SETPOINT, _SCHEDULE, _LOCK, _ECO, _TEMPERATURE,
+        {"dps": "102", "unit": 7, "kind": "temperature", "divisor": 2, "name": "Floor Temperature",
+         "device": {"TypeName": "Temperature", "Used": 0}},
+    ],
+    # fan coil thermostat
+    "BAC-002": [
+        _POWER, _SETPOINT, _SCHEDULE, _LOCK, _ECO, _TEMPERATURE,
+        {"dps": "102", "unit": 7, "kind": "selector", "levels": {10: "cold", 20: "hot", 30: "wind"},
+         "name": "System Mode",
+         "device": {"TypeName": "Selector Switch", "Switchtype": 18,
+                    "Options": _selector_options(["Off", "Cool", "Heat", "Fan"])}},
+        {"dps": "103", "unit": 8, "kind": "selector", "levels": {10: "auto", 20: "low", 30: "middle", 40: "high"},
+         "name": "Fan Speed",
+         "device": {"TypeName": "Selector Switch", "Switchtype": 18,
+                    "Options": _selector_options(["Off", "Auto", "Low", "Medium", "High"])}},
+    ],
+}
+
+
+########################################################################################
+#
+# decoders: dps value -> (nValue, sValue)
+# encoders: (Command, Level) -> dps value, None when the command does not apply
+#
+########################################################################################
+def _switch(spec, multiplier):
+    def decode(value):
+        return (1, "On") if value else (0, "Off")
+
+    def encode(command, level):
+        return {"On": True, "Off": False}.get(command)
+
+    return decode, encode
+
+
+def _temperature(spec, multiplier):
+    divisor = spec["divisor"]
+
+    def decode(value):
+        return 0, str(round(value / divisor * multiplier, 1))
+
+    def encode(command, level):
+        if command != "Set Level":
+            return None
+        return math.floor(divisor * level / multiplier)
+
+    return decode, encode if spec.get("setpoint") else None
+
+
+def _selector(spec, multiplier):
+    levels = spec["levels"]
+    values = {}
+    for level, value in levels.items():
+        values[value] = (level, str(level))
+    default = spec.get("default")
+    unknown = (default, str(default)) if default is not None else None
+
+    def decode(value):
+        return values.get(value, unknown)
+
+    def encode(command, level):
+        if command != "Set Level":
+            return None
+        return levels.get(int(level))
+
+    return decode, encode
+
+
+_KINDS = {
+    "switch": _switch,
+    "temperature": _temperature,
+    "selector": _selector,
+}
+
+
+########################################################################################
+#
+# compile_model
+#    build the lookup tables of a model
+#
+# Returns a tuple (decoders, encoders)
+#    decoders: {dps: (unit offset, decode, sensor)}, sensor is True for
+#              read only temperatures (subject to the write policy)
+#    encoders: {unit offset: (dps, encode)}
+#
+########################################################################################
+def compile_model(name, multiplier):
+    if name not in MODELS:
+        raise ValueError("Unknown thermostat model: " + str(name))
+
+    decoders = {}
+    encoders = {}
+    for spec in MODELS[name]:
+        decode, encode = _KINDS[spec["kind"]](spec, multiplier)
+        sensor = spec["kind"] == "temperature" and not spec.get("setpoint")
+        decoders[spec["dps"]] = (spec["unit"], decode, sensor)
+        if encode is not None:
+            encoders[spec["unit"]] = (spec["dps"], encode)
+    return decoders, encoders
+
+
+########################################################################################
+#
+# power_dps
+#    dps of the On / Off switch of a model
+#
+########################################################################################
+def power_dps(name):
+    if name not in MODELS:
+        raise ValueError("Unknown thermostat model: " + str(name))
+    for spec in MODELS[name]:
+        if spec["kind"] == "switch":
+            return spec["dps"]
+    raise ValueError("Thermostat model " + name + " has no On / Off switch")
@@ -0,0 +1,179 @@
+########################################################################################
+#     Domoticz Tuya Smart Plug Python Plugin                                              #
+#                                                                                      #
+#     MIT License                                                                        #
+#                                                                                      #
+#    Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#    Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#    of this software and associated documentation files (the "Software"), to deal      #
+#    in the Software without restriction, including without limitation the rights       #
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#    copies of the Software, and to permit persons to whom the Software is              #
+#    furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#    The above copyright notice and this permission notice shall be included in all     #
+#    copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#    SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+# asyncio client of the Tuya LAN protocol, used by the command line tools
+# to talk to many thermostats at once.
+#
+# An exchange sends one request and waits for its answer; the whole
+# exchange (connect included) is bounded by a timeout. run_all() runs a job
+# per inventory entry with a bounded number of open sockets and yields the
+# results as they finish. The entries of one device, e.g. the sub-devices
+# of a gateway, run one after another over a single connection (a Link):
+# Tuya devices accept very few local connections.
+
+import asyncio
+import json
+import time
+
+import tuya_protocol
+
+DEFAULT_PORT = 6668
+
+
+class TuyaError(Exception):
+    pass
+
+
+########################################################################################
+#
+# Link
+#    connection to a device, opened by the first exchange and kept for the
+#    next ones; closed after a failure, the next exchange opens it again
+#
+########################################################################################
+class Link:
+
+    def __init__(self, address):
+        host, _, port = address.partition(":")
+        self.host = host
+        self.port = int(port or DEFAULT_PORT)
+        self.reader = None
+        self.writer = None
+        self.reassembler = None
+        self.seqno = 0
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.reassembler = tuya_protocol.FrameReassembler()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = self.reassembler = None
+
+
+########################################################################################
+#
+# exchange
+#    send a status or set request to the device of an inventory entry,
+#    over link when given (a connection of its own otherwise)
+#
+#    Returns the decoded json answer, {} when the device answered with an
+#    empty payload (some firmwares do for a set).
+#
+########################################################################################
+async def exchange(entry, command, data=None, timeout=5.0, link=None):
+    own = link is None
+    if own:
+        link = Link(entry["address"])
+    try:
+        return await asyncio.wait_for(_exchange(link, entry, command, data), timeout)
+    except BaseException:
+        # a timeout (the cancellation) or an error may leave half an answer behind
+        link.close()
+        raise
+    finally:
+        if own:
+            link.close()
+
+
+async def _exchange(link, entry, command, data):
+    ctx = tuya_protocol.CryptoContext(entry["local_key"])
+    link.seqno += 1
+    frame = tuya_protocol.generate_payload(ctx, entry["dev_id"], entry["version"], command, data, link.seqno,
+                                           entry.get("cid"))
+    cmd = tuya_protocol.COMMANDS[command]
+
+    if link.writer is None:
+        await link.open()
+    link.writer.write(frame)
+    await link.writer.drain()
+    while True:
+        chunk = await link.reader.read(4096)
+        if not chunk:
+            raise TuyaError("connection closed by the device")
+        for answer in link.reassembler.feed(chunk):
+            if answer.cmd != cmd:
+                continue  # status pushed on its own
+            try:
+                raw = tuya_protocol.decrypt_payload(ctx, answer.payload)
+                if not raw:
+                    return {}
+                result = json.loads(raw.decode("utf-8"))
+            except ValueError:
+                raise TuyaError("cannot decode the answer, check the local key and the version")
+            # a gateway also pushes the status of its other sub-devices
+            if isinstance(result, dict) and result.get("cid", entry.get("cid")) != entry.get("cid"):
+                continue
+            return result
+
+
+########################################################################################
+#
+# run_all
+#    run job(entry, link) for each entry, at most concurrency devices at a
+#    time, and yield (entry, result, error, seconds) as the jobs finish.
+#    The entries with the same address and devID share the link.
+#
+########################################################################################
+async def run_all(entries, job, concurrency=64):
+    semaphore = asyncio.Semaphore(concurrency)
+    finished = asyncio.Queue()
+    devices = {}
+    for entry in entries:
+        devices.setdefault((entry["address"], entry["dev_id"]), []).append(entry)
+
+    async def run(group):
+        async with semaphore:
+            link = Link(group[0]["address"])
+            try:
+                for entry in group:
+                    start = time.monotonic()
+                    try:
+                        result = await job(entry, link)
+                        outcome = entry, result, None, time.monotonic() - start
+                    except asyncio.TimeoutError:
+                        outcome = entry, None, "timeout", time.monotonic() - start
+                    except (OSError, TuyaError, ValueError) as e:
+                        outcome = entry, None, str(e) or type(e).__name__, time.monotonic() - start
+                    await finished.put(outcome)
+            except Exception as e:
+                await finished.put(e)  # raised again by the generator
+            finally:
+                link.close()
+
+    tasks = [asyncio.ensure_future(run(group)) for group in devices.values()]
+    try:
+        for _ in range(len(entries)):
+            outcome = await finished.get()
+            if isinstance(outcome, Exception):
+                raise outcome
+            yield outcome
+    finally:
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,196 @@
+#!/usr/bin/python3
+
+########################################################################################
+#     Domoticz Tuya Smart Plug Python Plugin                                              #
+#                                                                                      #
+#     MIT License                                                                        #
+#                                                                                      #
+#    Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#    Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#    of this software and associated documentation files (the "Software"), to deal      #
+#    in the Software without restriction, including without limitation the rights       #
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#    copies of the Software, and to permit persons to whom the Software is              #
+#    furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#    The above copyright notice and this permission notice shall be included in all     #
+#    copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#    SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+
+# Discovery of the Tuya devices on the LAN.
+#
+# Tuya devices broadcast a frame (command 0x13) every few seconds: 3.1
+# devices send plain json on UDP port 6666, 3.3 devices send json
+# encrypted with a key shared by all devices on UDP port 6667. The json
+# holds the devID ("gwId"), the IP address and the protocol version.
+#
+# DiscoveryIndex keeps the last address seen for each devID, for ttl
+# seconds. The plugin feeds it from Domoticz UDP connections (discovery
+# option); run as a script, this module listens on its own and prints the
+# devices as they show up:
+#
+# usage: tuya_discovery.py [--ports 6666,6667] [--duration 30]
+#
+# tuya_simulator.py --announce sends the same broadcasts for its virtual
+# devices, to try it without real devices.
+
+import argparse
+import json
+import selectors
+import socket
+import time
+from hashlib import md5
+
+import tuya_protocol
+
+DISCOVERY_PORTS = (6666, 6667)
+CMD_DISCOVERY = 0x13
+UDP_KEY = md5(b'yGAdlopoPVldABfn').digest()  # key of the 6667 broadcasts
+
+_crypto = tuya_protocol.CryptoContext(UDP_KEY)
+
+
+########################################################################################
+#
+# decode_datagram
+#    json of a discovery broadcast, None when it is not one
+#
+########################################################################################
+def decode_datagram(data):
+    # a datagram holds a single frame, broadcasts are not all crc checked by devices
+    frames = tuya_protocol.FrameReassembler(check_crc=False).feed(data)
+    if not frames:
+        return None
+    payload = bytes(frames[0].payload)
+    try:
+        if not payload.startswith(b'{'):
+            payload = _crypto.decrypt(payload, False)
+        info = json.loads(payload.decode('utf-8'))
+    except ValueError:
+        return None
+    if not isinstance(info, dict) or not info.get('gwId') or not info.get('ip'):
+        return None
+    return info
+
+
+########################################################################################
+#
+# encode_datagram
+#    discovery broadcast of a device, the way 3.1 (plain) and 3.3
+#    (encrypted) devices send it
+#
+########################################################################################
+def encode_datagram(dev_id, ip, version, seqno=0):
+    info = {"ip": ip, "gwId": dev_id, "active": 2, "ability": 0, "mode": 0,
+            "encrypt": float(version) == 3.3, "productKey": "simulator", "version": str(version)}
+    payload = json.dumps(info, separators=(',', ':')).encode('utf-8')
+    if float(version) == 3.3:
+        payload = _crypto.encrypt(payload, False)
+    return tuya_protocol.build_frame(CMD_DISCOVERY, payload, seqno, 0)
+
+
+########################################################################################
+#
+# DiscoveryIndex
+#    devID -> (IP, version) of the devices heard lately
+#
+########################################################################################
+class DiscoveryIndex:
+
+    TTL = 120  # seconds an address is trusted after the last broadcast
+
+    def __init__(self, ttl=TTL):
+        self.ttl = ttl
+        self.__devices = {}  # devID -> (ip, version, expiry)
+
+    # record a broadcast, True when the address or version of the device changed
+    def update(self, info, now=None):
+        now = time.time() if now is None else now
+        dev_id = info['gwId']
+        address = (str(info['ip']), str(info.get('version', '3.3')))
+        known = self.__devices.get(dev_id)
+        self.__devices[dev_id] = address + (now + self.ttl,)
+        return known is None or known[:2] != address
+
+    # (ip, version) of a device, None when unknown or expired
+    def lookup(self, dev_id, now=None):
+        known = self.__devices.get(dev_id)
+        if known is None:
+            return None
+        if known[2] < (time.time() if now is None else now):
+            del self.__devices[dev_id]
+            return None
+        return known[:2]
+
+    def devices(self, now=None):
+        now = time.time() if now is None else now
+        return {dev_id: known[:2] for dev_id, known in self.__devices.items() if known[2] >= now}
+
+
+########################################################################################
+#
+# listen
+#    receive the broadcasts on ports for duration seconds (forever when 0),
+#    call found(info, changed) for each one
+#
+########################################################################################
+def listen(index, ports, duration, found):
+    selector = selectors.DefaultSelector()
+    for port in ports:
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind(('', port))
+        sock.setblocking(False)
+        selector.register(sock, selectors.EVENT_READ)
+
+    deadline = time.monotonic() + duration if duration > 0 else None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            for key, _ in selector.select(timeout):
+                data, _ = key.fileobj.recvfrom(4096)
+                info = decode_datagram(data)
+                if info is not None:
+                    found(info, index.update(info))
+    finally:
+        for key in list(selector.get_map().values()):
+            key.fileobj.close()
+        selector.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Listen to the discovery broadcasts of Tuya devices")
+    parser.add_argument("--ports", default=",".join(str(port) for port in DISCOVERY_PORTS),
+                        help="UDP ports, separated by ','")
+    parser.add_argument("--duration", type=float, default=30, help="seconds to listen, 0 for ever")
+    parser.add_argument("--all", action="store_true", help="print every broadcast, not only new addresses")
+    args = parser.parse_args()
+
+    index = DiscoveryIndex()
+
+    def found(info, changed):
+        if changed or args.all:
+            print(json.dumps({"dev_id": info["gwId"], "ip": info["ip"], "version": info.get("version"),
+                              "product_key": info.get("productKey")}), flush=True)
+
+    try:
+        listen(index, [int(port) for port in args.ports.split(",")], args.duration, found)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
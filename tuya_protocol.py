@@ -0,0 +1,368 @@
+########################################################################################
+#     Domoticz Tuya Smart Plug Python Plugin                                              #
+#                                                                                      #
+#     MIT License                                                                        #
+#                                                                                      #
+#    Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#    Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#    of this software and associated documentation files (the "Software"), to deal      #
+#    in the Software without restriction, including without limitation the rights       #
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#    copies of the Software, and to permit persons to whom the Software is              #
+#    furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#    The above copyright notice and this permission notice shall be included in all     #
+#    copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#    SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+# Helpers shared by the plugin and the command line tools to deal with the
+# Tuya LAN protocol framing.
+#
+# Frame layout (all integers are big endian):
+#
+#   000055AA | seqno | cmd | length | [retcode] payload | crc32 | 0000AA55
+#
+# length counts every byte after the length field, suffix included. Frames
+# sent by a device carry a 4 bytes return code in front of the payload,
+# frames sent to a device do not.
+
+import base64
+import binascii
+import json
+import struct
+import time
+from hashlib import md5
+
+try:
+    from Crypto.Cipher import AES  # PyCrypto or PyCryptodome
+    pyaes = None
+except ImportError:
+    AES = None
+    import pyaes  # https://github.com/ricmoo/pyaes
+
+PREFIX = b'\x00\x00\x55\xaa'
+SUFFIX = b'\x00\x00\xaa\x55'
+
+HEADER_SIZE = 16  # prefix + seqno + cmd + length
+TRAILER_SIZE = 8  # crc + suffix
+RETCODE_SIZE = 4
+
+MAX_FRAME_LENGTH = 0x1000  # anything bigger is treated as garbage
+
+_HEADER = struct.Struct('>4I')
+
+# command types
+CMD_CONTROL = 0x07  # set dps
+CMD_STATUS = 0x08  # dps pushed by the device when they change
+CMD_HEART_BEAT = 0x09  # keep alive
+CMD_DP_QUERY = 0x0a  # status request
+
+COMMANDS = {
+    'set': CMD_CONTROL,
+    'status': CMD_DP_QUERY,
+    'heartbeat': CMD_HEART_BEAT,
+}
+
+PROTOCOL_VERSION_BYTES_31 = b'3.1'
+PROTOCOL_VERSION_BYTES_33 = b'3.3'
+PROTOCOL_33_HEADER = PROTOCOL_VERSION_BYTES_33 + 12 * b'\0'
+
+
+########################################################################################
+#
+# Frame
+#    a decoded frame; payload is a memoryview over the received buffer
+#
+########################################################################################
+class Frame:
+
+    __slots__ = ('seqno', 'cmd', 'retcode', 'payload')
+
+    def __init__(self, seqno, cmd, retcode, payload):
+        self.seqno = seqno
+        self.cmd = cmd
+        self.retcode = retcode
+        self.payload = payload
+
+    def __repr__(self):
+        return 'Frame(seqno=%d, cmd=%d, retcode=%r, payload=%r)' % (
+            self.seqno, self.cmd, self.retcode, bytes(self.payload))
+
+
+########################################################################################
+#
+# FrameReassembler
+#    incremental parser for a TCP stream of Tuya frames
+#
+#    feed() returns every complete frame found in the data received so far
+#    and keeps any partial tail for the next call. Frames are parsed from
+#    memoryviews so a read holding several frames is not copied; only an
+#    incomplete tail is copied into the internal buffer.
+#
+########################################################################################
+class FrameReassembler:
+
+    def __init__(self, has_retcode=True, check_crc=True):
+        self.has_retcode = has_retcode
+        self.check_crc = check_crc
+        self.dropped = 0  # frames or garbage chunks discarded
+        self.__pending = bytearray()
+
+    def reset(self):
+        self.__pending = bytearray()
+
+    def pending(self):
+        return len(self.__pending)
+
+    def feed(self, data):
+        if self.__pending:
+            self.__pending += data
+            data = bytes(self.__pending)
+            self.__pending = bytearray()
+
+        frames = []
+        view = memoryview(data)
+        size = len(data)
+        pos = 0
+
+        while size - pos >= HEADER_SIZE:
+            if view[pos:pos + 4] != PREFIX:
+                # resynchronize on the next prefix
+                start = data.find(PREFIX, pos + 1)
+                self.dropped += 1
+                if start == -1:
+                    # keep the last bytes, they may be the beginning of a prefix
+                    pos = max(pos, size - 3)
+                    break
+                pos = start
+                continue
+
+            _, seqno, cmd, length = _HEADER.unpack_from(data, pos)
+            if length < TRAILER_SIZE or length > MAX_FRAME_LENGTH:
+                self.dropped += 1
+                pos += 4
+                continue
+
+            end = pos + HEADER_SIZE + length
+            if end > size:
+                break  # partial frame, wait for more data
+
+            if view[end - 4:end] != SUFFIX:
+                self.dropped += 1
+                pos += 4
+                continue
+
+            if self.check_crc:
+                crc = struct.unpack_from('>I', data, end - TRAILER_SIZE)[0]
+                if binascii.crc32(view[pos:end - TRAILER_SIZE]) & 0xffffffff != crc:
+                    self.dropped += 1
+                    pos = end
+                    continue
+
+            body = pos + HEADER_SIZE
+            retcode = None
+            if self.has_retcode and length >= TRAILER_SIZE + RETCODE_SIZE:
+                retcode = struct.unpack_from('>I', data, body)[0]
+                body += RETCODE_SIZE
+
+            frames.append(Frame(seqno, cmd, retcode, view[body:end - TRAILER_SIZE]))
+            pos = end
+
+        if pos < size:
+            self.__pending += view[pos:]
+
+        return frames
+
+
+########################################################################################
+#
+# CryptoContext
+#    AES-128-ECB state of a device, built once per local key
+#
+#    pytuya creates a new AESCipher (and so a new key schedule) for every
+#    payload. ECB has no per message state, so a single cipher object can
+#    serve both the receive and the send path of a device.
+#
+########################################################################################
+class CryptoContext:
+
+    BLOCK_SIZE = 16
+
+    def __init__(self, local_key):
+        if isinstance(local_key, str):
+            local_key = local_key.encode('latin1')
+        self.local_key = local_key
+        if AES is not None:
+            self.__cipher = AES.new(local_key, AES.MODE_ECB)
+        else:
+            self.__cipher = pyaes.AESModeOfOperationECB(local_key)
+
+    def __ecb(self, data, encrypt):
+        if AES is not None:
+            if encrypt:
+                return self.__cipher.encrypt(data)
+            return self.__cipher.decrypt(data)
+        process = self.__cipher.encrypt if encrypt else self.__cipher.decrypt
+        return b''.join(process(bytes(data[i:i + self.BLOCK_SIZE]))
+                        for i in range(0, len(data), self.BLOCK_SIZE))
+
+    def encrypt(self, raw, use_base64=True):
+        padnum = self.BLOCK_SIZE - len(raw) % self.BLOCK_SIZE
+        crypted = self.__ecb(bytes(raw) + padnum * bytes((padnum,)), True)
+        if use_base64:
+            return base64.b64encode(crypted)
+        return crypted
+
+    def decrypt(self, enc, use_base64=True):
+        if use_base64:
+            enc = base64.b64decode(enc)
+        elif not isinstance(enc, bytes):
+            enc = bytes(enc)
+        raw = self.__ecb(enc, False)
+        return raw[:-raw[-1]] if raw else raw
+
+    # md5 signature of an encrypted v3.1 payload
+    def sign31(self, b64payload):
+        digest = md5(b'data=' + b64payload + b'||lpv=' +
+                     PROTOCOL_VERSION_BYTES_31 + b'||' + self.local_key).hexdigest()
+        return digest[8:][:16].encode('latin1')
+
+
+########################################################################################
+#
+# crypto_for_key
+#    return ctx if it was built for local_key, a new context otherwise
+#
+########################################################################################
+def crypto_for_key(ctx, local_key):
+    if isinstance(local_key, str):
+        local_key = local_key.encode('latin1')
+    if ctx is None or ctx.local_key != local_key:
+        ctx = CryptoContext(local_key)
+    return ctx
+
+
+########################################################################################
+#
+# build_frame
+#    wrap a payload into a frame; frames sent by a device have a retcode
+#
+########################################################################################
+def build_frame(cmd, payload, seqno=0, retcode=None):
+    if retcode is not None:
+        payload = struct.pack('>I', retcode) + payload
+    buffer = _HEADER.pack(0x000055aa, seqno, cmd, len(payload) + TRAILER_SIZE) + payload
+    return buffer + struct.pack('>I', binascii.crc32(buffer) & 0xffffffff) + SUFFIX
+
+
+########################################################################################
+#
+# generate_payload
+#    same frames as pytuya's XenonDevice.generate_payload, but encrypted
+#    with the cached crypto context of the device; cid addresses a
+#    sub-device behind a gateway (dev_id is then the gateway)
+#
+########################################################################################
+def generate_payload(ctx, dev_id, version, command, data=None, seqno=0, cid=None):
+    if command in ('status', 'heartbeat'):
+        json_data = {'gwId': dev_id, 'devId': dev_id}
+    elif command == 'set':
+        json_data = {'devId': dev_id, 'uid': dev_id, 't': str(int(time.time()))}
+    else:
+        raise ValueError('Unsupported command: ' + str(command))
+    if cid is not None:
+        json_data['cid'] = cid
+    if data is not None:
+        json_data['dps'] = data
+    cmd = COMMANDS[command]
+
+    json_payload = json.dumps(json_data, separators=(',', ':')).encode('utf-8')
+
+    if float(version) == 3.3:
+        json_payload = ctx.encrypt(json_payload, False)
+        if cmd == CMD_CONTROL:
+            json_payload = PROTOCOL_33_HEADER + json_payload
+    elif cmd == CMD_CONTROL:
+        json_payload = ctx.encrypt(json_payload)
+        json_payload = PROTOCOL_VERSION_BYTES_31 + ctx.sign31(json_payload) + json_payload
+
+    return build_frame(cmd, json_payload, seqno)
+
+
+########################################################################################
+#
+# decrypt_payload
+#    json bytes of a payload in any of the forms sent by 3.1 and 3.3 devices
+#
+########################################################################################
+def decrypt_payload(ctx, payload):
+    payload = bytes(payload)
+    if not payload or payload[:1] == b'{':
+        return payload
+    if payload.startswith(PROTOCOL_VERSION_BYTES_31):
+        # version, 16 bytes of md5 signature, base64
+        return ctx.decrypt(payload[len(PROTOCOL_VERSION_BYTES_31) + 16:])
+    if payload.startswith(PROTOCOL_VERSION_BYTES_33):
+        payload = payload[len(PROTOCOL_33_HEADER):]
+    return ctx.decrypt(payload, False)
+
+
+########################################################################################
+#
+# PayloadCache
+#    status and heartbeat frames never change for a device, encode them once
+#    and only patch the sequence number and the crc before sending
+#
+########################################################################################
+class PayloadCache:
+
+    CACHED = ('status', 'heartbeat')
+
+    def __init__(self, ctx, dev_id, version, cid=None):
+        self.local_key = ctx.local_key
+        self.dev_id = dev_id
+        self.version = float(version)
+        self.cid = cid
+        self.__templates = {}
+        for command in self.CACHED:
+            self.__templates[command] = bytearray(
+                generate_payload(ctx, dev_id, version, command, cid=cid))
+        self.hits = 0
+
+    def matches(self, ctx, dev_id, version, cid=None):
+        return (self.local_key == ctx.local_key and self.dev_id == dev_id
+                and self.version == float(version) and self.cid == cid)
+
+    def frame(self, command, seqno=0):
+        template = self.__templates.get(command)
+        if template is None:
+            return None
+        self.hits += 1
+        struct.pack_into('>I', template, 4, seqno)
+        crc_offset = len(template) - TRAILER_SIZE
+        struct.pack_into('>I', template, crc_offset,
+                         binascii.crc32(memoryview(template)[:crc_offset]) & 0xffffffff)
+        return bytes(template)
+
+
+########################################################################################
+#
+# payload_cache_for
+#    return cache if it was built for this key, device, version and
+#    sub-device, a new cache otherwise
+#
+########################################################################################
+def payload_cache_for(cache, ctx, dev_id, version, cid=None):
+    if cache is None or not cache.matches(ctx, dev_id, version, cid):
+        cache = PayloadCache(ctx, dev_id, version, cid)
+    return cache
@@ -0,0 +1,296 @@
+#!/usr/bin/python3
+
+########################################################################################
+#     Domoticz Tuya Smart Plug Python Plugin                                              #
+#                                                                                      #
+#     MIT License                                                                        #
+#                                                                                      #
+#    Copyright (c) 2018 tixi                                                            #
+#                                                                                      #
+#    Permission is hereby granted, free of charge, to any person obtaining a copy       #
+#    of this software and associated documentation files (the "Software"), to deal      #
+#    in the Software without restriction, including without limitation the rights       #
+#    to use, copy, modify, merge, publish, distribute, sublicense, and/or sell          #
+#    copies of the Software, and to permit persons to whom the Software is              #
+#    furnished to do so, subject to the following conditions:                           #
+#                                                                                      #
+#    The above copyright notice and this permission notice shall be included in all     #
+#    copies or substantial portions of the Software.                                    #
+#                                                                                      #
+#    THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR         #
+#    IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,           #
+#    FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE        #
+#    AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER             #
+#    LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,      #
+#    OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE      #
+#    SOFTWARE.                                                                          #
+#                                                                                      #
+########################################################################################
+
+# Tuya thermostat simulator, to run the plugin and the helper scripts
+# without a real device on the LAN.
+#
+# Every virtual device listens on its own TCP port (or its own loopback
+# address), speaks the 3.1 or 3.3 protocol and keeps the dps of a BHT-002.
+# It answers status, set and heart beat requests and can push status
+# frames on its own. Network trouble can be injected: latency, jitter,
+# frames coalesced in a single write or split over several, dropped
+# answers.
+#
+# usage: tuya_simulator.py --count 100 --port 7000 --inventory sim.json
+#
+# The inventory file lists the virtual devices in the format read by the
+# plugin 'inventory' option (addresses are written as ip:port).
+#
+# --children turns every virtual device into a gateway holding that many
+# sub-devices, each with its own dps, addressed by the cid of the requests
+# (the inventory then lists the sub-devices).
+#
+# --announce broadcasts the discovery datagrams of the virtual devices like
+# real ones do (3.1 devices on UDP port 6666, 3.3 devices on 6667), see
+# tuya_discovery.py.
+
+import argparse
+import asyncio
+import json
+import random
+import socket
+import time
+
+import tuya_discovery
+import tuya_protocol
+
+DEFAULT_DPS = {"1": True, "2": 42, "3": 40, "4": "0", "5": False, "6": False, "102": 38}
+
+
+########################################################################################
+#
+# VirtualDevice
+#    state and protocol handling of one simulated thermostat
+#
+########################################################################################
+class VirtualDevice:
+
+    def __init__(self, dev_id, local_key, version, args):
+        self.dev_id = dev_id
+        self.local_key = local_key
+        self.version = float(version)
+        self.args = args
+        self.dps = dict(DEFAULT_DPS)
+        # gateway: cid -> dps of each sub-device
+        self.children = {"%02d" % i: dict(DEFAULT_DPS) for i in range(args.children)}
+        self.crypto = tuya_protocol.CryptoContext(local_key)
+        self.writers = set()
+        self.seqno = 0
+
+    # payload of a frame sent by the device
+    def encode(self, data, header):
+        raw = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        if self.version == 3.3:
+            raw = self.crypto.encrypt(raw, False)
+            return tuya_protocol.PROTOCOL_33_HEADER + raw if header else raw
+        if header:
+            raw = self.crypto.encrypt(raw)
+            return tuya_protocol.PROTOCOL_VERSION_BYTES_31 + self.crypto.sign31(raw) + raw
+        return raw
+
+    # json of a frame sent to the device
+    def decode(self, frame):
+        payload = bytes(frame.payload)
+        if self.version == 3.3:
+            if payload.startswith(tuya_protocol.PROTOCOL_VERSION_BYTES_33):
+                payload = payload[len(tuya_protocol.PROTOCOL_33_HEADER):]
+            payload = self.crypto.decrypt(payload, False)
+        elif payload.startswith(tuya_protocol.PROTOCOL_VERSION_BYTES_31):
+            payload = self.crypto.decrypt(payload[len(tuya_protocol.PROTOCOL_VERSION_BYTES_31) + 16:])
+        return json.loads(payload) if payload else {}
+
+    def status_payload(self, dps, header, cid=None):
+        data = {"devId": self.dev_id, "dps": dps, "t": int(time.time())}
+        if cid is not None:
+            data["cid"] = cid
+        return self.encode(data, header)
+
+    # dps of the device or of the sub-device given by the cid of a request
+    def dps_of(self, cid):
+        if self.children:
+            return self.children.get(cid)
+        return self.dps
+
+    # answer frames of a request
+    def handle(self, frame):
+        if frame.cmd == tuya_protocol.CMD_HEART_BEAT:
+            return [tuya_protocol.build_frame(frame.cmd, b'', frame.seqno, 0)]
+
+        try:
+            request = self.decode(frame)
+        except ValueError:
+            return [tuya_protocol.build_frame(frame.cmd, b'data format error', frame.seqno, 1)]
+
+        cid = request.get("cid")
+        dps = self.dps_of(cid)
+        if dps is None:
+            return [tuya_protocol.build_frame(frame.cmd, b'unknown cid', frame.seqno, 1)]
+
+        if frame.cmd == tuya_protocol.CMD_DP_QUERY:
+            return [tuya_protocol.build_frame(frame.cmd, self.status_payload(dps, False, cid), frame.seqno, 0)]
+
+        if frame.cmd == tuya_protocol.CMD_CONTROL:
+            changes = request.get("dps", {})
+            dps.update(changes)
+            return [tuya_protocol.build_frame(frame.cmd, b'', frame.seqno, 0),
+                    self.push_frame(changes, cid)]
+
+        return [tuya_protocol.build_frame(frame.cmd, b'', frame.seqno, 1)]
+
+    def push_frame(self, dps, cid=None):
+        self.seqno += 1
+        return tuya_protocol.build_frame(tuya_protocol.CMD_STATUS, self.status_payload(dps, True, cid), self.seqno, 0)
+
+    # send frames with the configured network trouble
+    async def send(self, writer, frames):
+        args = self.args
+        frames = [f for f in frames if random.random() >= args.drop]
+        if not frames:
+            return
+        await asyncio.sleep(args.latency + random.uniform(0, args.jitter))
+
+        if random.random() < args.coalesce:
+            chunks = [b''.join(frames)]
+        else:
+            chunks = frames
+
+        for chunk in chunks:
+            if random.random() < args.split and len(chunk) > 1:
+                cut = random.randint(1, len(chunk) - 1)
+                writer.write(chunk[:cut])
+                await writer.drain()
+                await asyncio.sleep(random.uniform(0, args.jitter) or 0.001)
+                chunk = chunk[cut:]
+            writer.write(chunk)
+        await writer.drain()
+
+    async def serve(self, reader, writer):
+        reassembler = tuya_protocol.FrameReassembler(has_retcode=False)
+        self.writers.add(writer)
+        try:
+            while True:
+                data = await reader.read(4096)
+                if not data:
+                    break
+                for frame in reassembler.feed(data):
+                    await self.send(writer, self.handle(frame))
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    # unsolicited changes: the room temperature moves
+    async def drift(self):
+        while True:
+            await asyncio.sleep(self.args.push_interval * random.uniform(0.5, 1.5))
+            cid = random.choice(list(self.children)) if self.children else None
+            dps = self.dps_of(cid)
+            dps["3"] = max(0, dps["3"] + random.choice((-1, 1)))
+            frame = self.push_frame({"3": dps["3"]}, cid)
+            for writer in list(self.writers):
+                try:
+                    await self.send(writer, [frame])
+                except ConnectionError:
+                    self.writers.discard(writer)
+
+
+########################################################################################
+#
+# announce
+#    discovery broadcasts of the virtual devices
+#
+########################################################################################
+async def announce(inventory, args):
+    port = args.announce_port or tuya_discovery.DISCOVERY_PORTS[args.version == "3.3"]
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+    sock.setblocking(False)
+    devices = list({entry["dev_id"]: entry for entry in inventory}.values())  # one per gateway
+    while True:
+        for entry in devices:
+            ip = args.announce_ip or entry["address"].partition(":")[0]
+            try:
+                sock.sendto(tuya_discovery.encode_datagram(entry["dev_id"], ip, args.version),
+                            (args.announce_to, port))
+            except OSError as e:
+                print("Cannot send the discovery broadcast: " + str(e))
+        await asyncio.sleep(args.announce)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tuya thermostat simulator")
+    parser.add_argument("--host", default="127.0.0.1", help="first listen address")
+    parser.add_argument("--port", type=int, default=6668, help="first listen port")
+    parser.add_argument("--count", type=int, default=1, help="number of virtual devices")
+    parser.add_argument("--spread", choices=("port", "host"), default="port",
+                        help="give each device its own port or its own loopback address")
+    parser.add_argument("--version", choices=("3.1", "3.3"), default="3.3")
+    parser.add_argument("--dev-id", default="simthermostat", help="devID prefix")
+    parser.add_argument("--local-key", default="0123456789abcdef")
+    parser.add_argument("--latency", type=float, default=0.0, help="answer delay (seconds)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra delay (seconds)")
+    parser.add_argument("--coalesce", type=float, default=0.0,
+                        help="probability to send the frames of an answer in a single write")
+    parser.add_argument("--split", type=float, default=0.0, help="probability to split a write in two")
+    parser.add_argument("--drop", type=float, default=0.0, help="probability to drop an answer frame")
+    parser.add_argument("--push-interval", type=float, default=0.0,
+                        help="mean seconds between unsolicited temperature changes, 0 disables them")
+    parser.add_argument("--children", type=int, default=0,
+                        help="make each device a gateway with this many sub-devices (cid 00, 01, ...)")
+    parser.add_argument("--inventory", help="write the virtual devices to this JSON inventory")
+    parser.add_argument("--announce", type=float, default=0.0,
+                        help="seconds between two discovery broadcasts of each device, 0 disables them")
+    parser.add_argument("--announce-to", default="255.255.255.255", help="destination of the broadcasts")
+    parser.add_argument("--announce-port", type=int, default=0,
+                        help="UDP port of the broadcasts, default 6666 for 3.1 and 6667 for 3.3")
+    parser.add_argument("--announce-ip", help="IP address announced instead of the listen address")
+    args = parser.parse_args()
+
+    if len(args.local_key) != 16:
+        print("local key must be 16 characters long")
+        exit(1)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    inventory = []
+    host_prefix, _, host_last = args.host.rpartition(".")
+
+    for i in range(args.count):
+        if args.spread == "port":
+            host, port = args.host, args.port + i
+        else:
+            host, port = host_prefix + "." + str(int(host_last) + i), args.port
+        device = VirtualDevice("%s%04d" % (args.dev_id, i), args.local_key, args.version, args)
+        loop.run_until_complete(asyncio.start_server(device.serve, host, port))
+        if args.push_interval > 0:
+            loop.create_task(device.drift())
+        entry = {"name": device.dev_id, "address": "%s:%d" % (host, port), "dev_id": device.dev_id,
+                 "local_key": args.local_key, "version": args.version}
+        if device.children:
+            inventory.extend(dict(entry, name=device.dev_id + "/" + cid, cid=cid) for cid in device.children)
+        else:
+            inventory.append(entry)
+
+    if args.announce > 0:
+        loop.create_task(announce(inventory, args))
+
+    if args.inventory:
+        with open(args.inventory, "w") as f:
+            json.dump(inventory, f, indent=1)
+
+    print("%d virtual device(s) listening from %s" % (args.count, inventory[0]["address"]))
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()